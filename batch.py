@@ -0,0 +1,144 @@
+#!/usr/bin/python
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import linear
+from cutlist import file_names
+
+def read_configs(source):
+	"""
+	This function yields (name, cut configuration, error) for every
+	configuration in source: each .json file in a directory, named after the
+	file, or each line of a JSONL file, or of stdin if source is "-", named
+	after the file and line number unless the configuration has a "name" of
+	its own. A configuration that cannot be read is yielded as None, with
+	what was wrong with it as error, which is None otherwise.
+	"""
+	def parse(text, where):
+		try:
+			config = json.loads(text)
+		except ValueError as e:
+			return None, f"{where}: {type(e).__name__}: {e}"
+		if not isinstance(config, dict):
+			return None, f"{where}: not a JSON object"
+		return config, None
+
+	if os.path.isdir(source):
+		for file_name in sorted(os.listdir(source)):
+			if file_name.endswith(".json"):
+				path = os.path.join(source, file_name)
+				try:
+					with open(path, encoding="utf8") as f:
+						text = f.read()
+				except (OSError, ValueError) as e:
+					yield os.path.splitext(file_name)[0], None, f"{path}: {type(e).__name__}: {e}"
+					continue
+				yield (os.path.splitext(file_name)[0],) + parse(text, path)
+		return
+	stem = "stdin" if source == "-" else os.path.splitext(os.path.basename(source))[0]
+	f = sys.stdin if source == "-" else open(source, encoding="utf8")
+	try:
+		for number, line in enumerate(f, 1):
+			if line.strip():
+				config, error = parse(line, f"{source} line {number}")
+				name = f"{stem}_{number:04d}"
+				yield (config.get("name", name) if config is not None else name), config, error
+	finally:
+		if f is not sys.stdin:
+			f.close()
+
+def generate(name, config, output_dir, options, file_name=None):
+	"""
+	Generates one cutlist with linear.generateCutList() in stream mode and
+	returns its manifest entry, with what shortening jumps and compacting
+	did (see generateCutList's report). The files are named file_name, name
+	by default, in output_dir. A configuration that fails is recorded with
+	its error, and without files, rather than stopping the batch.
+	"""
+	file_name = name if file_name is None else file_name
+	extension = ".csv.gz" if options.get("compress") else ".csv"
+	entry = {"name": name, "csv": os.path.join(output_dir, file_name + extension)}
+	if options.get("json"):
+		entry["json"] = os.path.join(output_dir, file_name + ".json")
+	if options.get("binary"):
+		entry["binary"] = os.path.join(output_dir, file_name + ".bin")
+	report = {}
+	start = time.perf_counter()
+	try:
+		linear.generateCutList(io.StringIO(json.dumps(config)), stream=True, output_path=entry["csv"],
+							   json_path=entry.get("json"), binary_path=entry.get("binary"),
+							   compress=options.get("compress", False),
+							   shorten_jumps=options.get("shorten_jumps", False),
+							   compact=options.get("compact", False), report=report)
+		entry.update(report)
+		entry["status"] = "ok"
+		entry["bytes"] = os.path.getsize(entry["csv"])
+	except Exception as e:
+		#The writer has deleted what it wrote, so no files are listed
+		entry = {"name": name, "status": "error", "error": f"{type(e).__name__}: {e}"}
+	entry["seconds"] = time.perf_counter() - start
+	return entry
+
+def batch(source, output_dir, workers=None, processes=True, **options):
+	"""
+	This function generates a cutlist for every configuration in source (see
+	read_configs) and writes them to output_dir, along with manifest.json,
+	which lists every cutlist's files, status and generation time in the
+	order they were read. The files are named after the configurations (see
+	cutlist.file_names), which cannot overwrite the manifest.
+
+	The cutlists are generated by a pool of workers, os.cpu_count() by
+	default, which are processes unless processes is False. Threads share
+	this module's import of linear. Worker processes share it only where
+	they are forked; where they are spawned, as on Windows and macOS, each
+	imports linear again when it starts. options are json, binary, compress,
+	shorten_jumps and compact, as for generateCutList().
+	"""
+	os.makedirs(output_dir, exist_ok=True)
+	workers = workers or os.cpu_count()
+	start = time.perf_counter()
+	configs = list(read_configs(source))
+	pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+	with pool:
+		futures = [pool.submit(generate, name, config, output_dir, options, file_name) if error is None else None
+				   for (name, config, error), file_name in zip(configs, file_names((name for name, _, _ in configs), reserved=("manifest",)))]
+		#Configurations that could not be read are failed entries of their own
+		entries = [future.result() if future is not None else {"name": name, "status": "error", "error": error, "seconds": 0.0}
+				   for future, (name, config, error) in zip(futures, configs)]
+
+	manifest = {"source": source,
+				"workers": workers,
+				"seconds": time.perf_counter() - start,
+				"failed": sum(entry["status"] != "ok" for entry in entries),
+				"cutlists": entries}
+	with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+		json.dump(manifest, f, indent=4)
+	return manifest
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Generate the cutlists for a directory or JSONL file of cut configurations.")
+	parser.add_argument("source", help="directory of .json configurations, JSONL file, or - for JSONL on stdin")
+	parser.add_argument("-o", "--output", default=linear.save_path, help="directory to write the cutlists and manifest.json to")
+	parser.add_argument("-w", "--workers", type=int, default=None, help="number of workers (default: one per CPU)")
+	parser.add_argument("--threads", action="store_true", help="use threads rather than processes")
+	parser.add_argument("--json", action="store_true", help="also write each cutlist as JSON")
+	parser.add_argument("--binary", action="store_true", help="also write each cutlist in the binary format")
+	parser.add_argument("--compress", action="store_true", help="gzip the CSV files")
+	parser.add_argument("--shorten-jumps", action="store_true", help="reorder scans to shorten jumps")
+	parser.add_argument("--compact", action="store_true", help="remove redundant commands")
+	args = parser.parse_args(argv)
+
+	manifest = batch(args.source, args.output, args.workers, not args.threads, json=args.json, binary=args.binary,
+					 compress=args.compress, shorten_jumps=args.shorten_jumps, compact=args.compact)
+	print(f"{len(manifest['cutlists'])} cutlists in {manifest['seconds']:.1f}s, {manifest['failed']} failed")
+	for entry in manifest["cutlists"]:
+		if entry["status"] != "ok":
+			print(f"{entry['name']}: {entry['error']}")
+	return 1 if manifest["failed"] else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
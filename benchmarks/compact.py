@@ -0,0 +1,70 @@
+#!/usr/bin/python
+"""
+Checks that compacting a cutlist as it is generated, segment by segment
+(optimise.peephole_segments), gives the same cutlist and the same counts
+of commands removed as optimise.peephole on the whole cutlist, on random
+variations of the oss_stacked_small configuration.
+
+	python benchmarks/compact.py [--count N] [--seed S]
+
+Exits with 1 if any configuration differs.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import linear
+from cutlist import Cutlist
+from optimise import peephole, peephole_segments
+
+def random_config(base, rng):
+	"""
+	Returns a copy of base with its block, cut and laser varied at random.
+	"""
+	config = copy.deepcopy(base)
+	config["block"].update(thickness=rng.choice([2, 3, 5]), physical_rotation=rng.choice([0, 30, 45.5, 90]),
+						   origin_x=round(rng.uniform(-1, 1), 3))
+	config["desired_cut"].update(final_dimension_x=round(rng.uniform(2, 8), 3), final_dimension_y=round(rng.uniform(2, 8), 3),
+								 pyramid_height=rng.choice([0.5, 1.0]), gap_size=rng.choice([0.1, 0.2]),
+								 base_height=rng.choice([0.3, 0.5]), excess=rng.choice(["top", "bottom"]),
+								 layers=rng.choice(["max", 3, 6]), core=rng.choice(["yes", "no"]),
+								 num_of_seeds=rng.randint(1, 4))
+	config["laser_cut_config"].update(xy_spacing=rng.choice([0.02, 0.05]), z_spacing=rng.choice([0.1, 0.2]))
+	return config
+
+def same(a, b):
+	return len(a) == len(b) and all(np.array_equal(getattr(a, name), getattr(b, name), equal_nan=name not in ("op", "fmt"))
+									for name in ("op", "x", "y", "value", "fmt"))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Check that compacting segment by segment matches compacting the whole cutlist.")
+	parser.add_argument("--count", type=int, default=20, help="random configurations to check")
+	parser.add_argument("--seed", type=int, default=0, help="seed of the random configurations")
+	args = parser.parse_args(argv)
+
+	with open(os.path.join(here, "configs", "oss_stacked_small.json")) as f:
+		base = json.load(f)
+	rng = random.Random(args.seed)
+	failed = 0
+	for i in range(args.count):
+		config = random_config(base, rng)
+		segments = list(linear.cut_segments(config["block"], config["desired_cut"], config["laser_cut_config"]))
+		streamed = {}
+		compacted = Cutlist.concat(peephole_segments(iter(segments), streamed))
+		whole, removed = peephole(Cutlist.concat(segments))
+		ok = same(compacted, whole) and streamed == removed
+		failed = failed + (not ok)
+		print(f"{i:3d} {len(whole):8d} commands {removed['total']:6d} removed {'match' if ok else 'DIFFERENT'}")
+		if not ok:
+			print(json.dumps(config))
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
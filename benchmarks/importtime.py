@@ -0,0 +1,60 @@
+#!/usr/bin/python
+"""
+Measures how long linear, visualise, offset, batch, diff and simulate take to
+import, with python -X importtime in a fresh interpreter, and checks that
+against the startup budget below. Importing any of them must not pull in the plotting
+libraries, which are only imported when a figure is made.
+
+	python benchmarks/importtime.py [--repeat N]
+
+Exits with 1 if a module is over budget or imports a heavy dependency.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+#Startup budget in ms, cumulative import time including numpy
+budget = {"linear": 400, "visualise": 400, "offset": 50, "batch": 400, "diff": 400, "simulate": 400}
+
+#Dependencies that take seconds to import and must stay lazy
+heavy = ["plotly", "pandas", "scipy", "matplotlib", "imageio"]
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_time(module):
+	"""
+	Imports module in a fresh interpreter and returns its cumulative import
+	time in ms and the names of every module imported along with it.
+	"""
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+							cwd=root, capture_output=True, text=True, check=True)
+	total = None
+	imported = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+		self_us, cumulative_us, name = line[len("import time:"):].split("|")
+		imported.append(name.strip())
+		if name.strip() == module:
+			total = int(cumulative_us) / 1000
+	return total, imported
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Check module import times against the startup budget.")
+	parser.add_argument("--repeat", type=int, default=5, help="imports per module, the fastest is kept")
+	args = parser.parse_args(argv)
+
+	failed = False
+	for module, limit in budget.items():
+		runs = [import_time(module) for _ in range(args.repeat)]
+		total = min(total for total, imported in runs)
+		loaded = sorted({name.split(".")[0] for name in runs[0][1]} & set(heavy))
+		ok = total <= limit and not loaded
+		failed = failed or not ok
+		print(f"{module:10s} {total:8.1f} ms  budget {limit:5d} ms  {'OK' if ok else 'OVER'}"
+			  + (f"  imports {', '.join(loaded)}" if loaded else ""))
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+"""
+Benchmarks cutlist generation on the reference configurations in
+benchmarks/configs, from small jobs to deep, finely spaced worst cases.
+
+For each configuration it records the commands emitted, the time taken to
+generate the cutlist and to write it as JSON, the peak memory traced while
+generating it and the size of the JSON. The results are written as JSON
+and compared with baseline.json, and every cutlist is checked against the
+sha256 of its golden JSON in golden.json, so a speedup cannot quietly
+change a toolpath.
+
+	python benchmarks/run.py [names] [--repeat N] [--tolerance T]
+	                         [--update-baseline] [--update-golden]
+
+Exits with 1 if a cutlist differs from its golden hash, or if generation
+is slower or uses more memory than the baseline by more than the
+tolerance. Timings depend on the machine, so the baseline should be
+updated on the machine the benchmarks are compared on.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import linear
+from cutlist import Cutlist
+
+config_dir = os.path.join(here, "configs")
+baseline_path = os.path.join(here, "baseline.json")
+golden_path = os.path.join(here, "golden.json")
+
+#Differences smaller than these are put down to noise, whatever the tolerance
+min_seconds = 0.005
+min_bytes = 1 << 20
+
+def generate(config):
+	"""
+	Generates the cutlist of config from scratch, with the geometry and
+	segment caches emptied first.
+	"""
+	linear.cache_clear()
+	return Cutlist.concat(linear.cut_segments(config.get("block"), config["desired_cut"], config["laser_cut_config"]))
+
+def benchmark(config, repeat):
+	"""
+	Returns the measurements for one configuration and the sha256 of its
+	JSON cutlist. Times are the best of repeat runs. Memory is measured on
+	a separate run, as tracing slows generation down.
+	"""
+	seconds = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		cutlist = generate(config)
+		seconds.append(time.perf_counter() - start)
+
+	tracemalloc.start()
+	generate(config)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	start = time.perf_counter()
+	data = cutlist.to_json().encode()
+	write_seconds = time.perf_counter() - start
+	result = {"commands": len(cutlist),
+			  "seconds": min(seconds),
+			  "write_seconds": write_seconds,
+			  "peak_bytes": peak,
+			  "bytes": len(data)}
+	return result, hashlib.sha256(data).hexdigest()
+
+def regressions(result, baseline, tolerance):
+	"""
+	Returns what got worse than the baseline by more than the tolerance.
+	"""
+	flags = []
+	for key, floor in (("seconds", min_seconds), ("write_seconds", min_seconds), ("peak_bytes", min_bytes)):
+		if key in baseline and result[key] > baseline[key] * (1 + tolerance) and result[key] - baseline[key] > floor:
+			flags.append(f"{key} {baseline[key]:.4g} -> {result[key]:.4g}")
+	for key in ("commands", "bytes"):
+		if key in baseline and result[key] != baseline[key]:
+			flags.append(f"{key} {baseline[key]} -> {result[key]}")
+	return flags
+
+def load_json(path):
+	if not os.path.exists(path):
+		return {}
+	with open(path) as f:
+		return json.load(f)
+
+def save_json(path, data):
+	with open(path, "w") as f:
+		json.dump(data, f, indent=4, sort_keys=True)
+		f.write("\n")
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark cutlist generation on the reference configurations.")
+	parser.add_argument("names", nargs="*", help="configurations to run (default: all)")
+	parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, the fastest is kept")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="fraction the baseline may be exceeded by")
+	parser.add_argument("--output", default=os.path.join(here, "results.json"), help="where to write the results (git ignores the default)")
+	parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+	parser.add_argument("--update-golden", action="store_true", help="store these cutlists' hashes as golden")
+	args = parser.parse_args(argv)
+
+	names = args.names or sorted(os.path.splitext(name)[0] for name in os.listdir(config_dir) if name.endswith(".json"))
+	baseline = load_json(baseline_path)
+	golden = load_json(golden_path)
+	results = {}
+	failed = False
+	for name in names:
+		with open(os.path.join(config_dir, name + ".json")) as f:
+			config = json.load(f)
+		result, digest = benchmark(config, args.repeat)
+		if args.update_golden:
+			golden[name] = digest
+		result["golden"] = "match" if golden.get(name) == digest else ("missing" if name not in golden else "DIFFERENT")
+		result["regressions"] = regressions(result, baseline.get(name, {}), args.tolerance)
+		results[name] = result
+		failed = failed or result["golden"] == "DIFFERENT" or bool(result["regressions"])
+		print(f"{name:20s} {result['commands']:9d} commands {result['seconds']*1000:9.1f} ms "
+			  f"write {result['write_seconds']*1000:8.1f} ms peak {result['peak_bytes']/1e6:7.1f} MB "
+			  f"{result['bytes']/1e6:7.1f} MB golden {result['golden']}")
+		for flag in result["regressions"]:
+			print(f"{'':20s} REGRESSION {flag}")
+
+	save_json(args.output, results)
+	if args.update_baseline:
+		baseline.update({name: {key: value for key, value in result.items() if key not in ("golden", "regressions")}
+						 for name, result in results.items()})
+		save_json(baseline_path, baseline)
+	if args.update_golden:
+		save_json(golden_path, golden)
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+"""
+Checks that shortening jumps (optimise.optimise_jumps) only changes the
+order and direction in which a cutlist's marks are cut, never what is cut,
+and that shortening segment by segment (optimise.optimise_segments), split
+anywhere, gives the same cutlist as shortening the whole cutlist. Runs a
+case where a mark follows a block with no jump before it, then random
+cutlists split at random.
+
+	python benchmarks/shorten.py [--count N] [--seed S]
+
+Exits with 1 if any cutlist differs.
+"""
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+from cutlist import Cutlist, JUMP, MARK
+from optimise import machine_trace, optimise_jumps, optimise_segments
+
+laser = {"jump_speed": 400}
+
+#The last mark is cut from where the block before the z_step ends
+anchored = [["jump", "0", "0"], ["mark", "1", "0"], ["jump", "10", "0"], ["mark", "11", "0"],
+			["jump", "1", "1"], ["mark", "2", "1"], ["z_step", "1"], ["mark", "5", "5"]]
+
+def cuts(cutlist):
+	"""
+	Returns the marks of a cutlist, as machine_trace() does, with the ends of
+	each in order and the marks between two commands that are not points
+	sorted, so that reordering and reversing polylines does not change them.
+	"""
+	marks = machine_trace(cutlist)[0]
+	op = cutlist.op
+	between = np.cumsum((op != JUMP) & (op != MARK))[op == MARK]
+	start, end = marks[:,:2], marks[:,2:4]
+	forwards = ((start[:,0] < end[:,0]) | ((start[:,0] == end[:,0]) & (start[:,1] <= end[:,1])))[:,None]
+	rows = np.column_stack((between, np.where(forwards, start, end), np.where(forwards, end, start), marks[:,4:]))
+	return rows[np.lexsort(rows.T[::-1])] if len(rows) else rows
+
+def same(a, b):
+	return len(a) == len(b) and all(np.array_equal(getattr(a, name), getattr(b, name), equal_nan=name not in ("op", "fmt"))
+									for name in ("op", "x", "y", "value", "fmt"))
+
+def random_cutlist(rng):
+	commands = []
+	for _ in range(rng.randint(1, 60)):
+		kind = rng.random()
+		if kind < 0.35:
+			commands.append(["jump", str(rng.randint(-5, 5)), str(rng.randint(-5, 5))])
+		elif kind < 0.85:
+			commands.append(["mark", str(rng.randint(-5, 5)), str(rng.randint(-5, 5))])
+		else:
+			commands.append(rng.choice([["z_step", "1"], ["c_rel", "90"], ["set_trigger4", "1", "0", "7", "8", "45"], ["stop_trigger"]]))
+	return Cutlist.from_list(commands)
+
+def check(cutlist, rng):
+	"""
+	Returns whether the cutlist shortened whole cuts the same as it, and the
+	same as shortened segment by segment, split at random.
+	"""
+	whole, report = optimise_jumps(cutlist, laser)
+	splits = sorted(rng.sample(range(1, len(cutlist)), min(rng.randint(0, 5), len(cutlist) - 1))) if len(cutlist) > 1 else []
+	bounds = [0] + splits + [len(cutlist)]
+	streamed = {}
+	segmented = Cutlist.concat(optimise_segments((cutlist[start:end] for start, end in zip(bounds[:-1], bounds[1:])), laser, streamed))
+	return (np.array_equal(cuts(cutlist), cuts(whole)) and same(whole, segmented)
+			and all(abs(streamed[key] - report[key]) < 1e-6 for key in report))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Check that shortening jumps never changes what is cut.")
+	parser.add_argument("--count", type=int, default=2000, help="random cutlists to check")
+	parser.add_argument("--seed", type=int, default=0, help="seed of the random cutlists")
+	args = parser.parse_args(argv)
+
+	rng = random.Random(args.seed)
+	failed = 0
+	ok = check(Cutlist.from_list(anchored), rng)
+	print(f"mark after a block: {'match' if ok else 'DIFFERENT'}")
+	failed = failed + (not ok)
+	for i in range(args.count):
+		cutlist = random_cutlist(rng)
+		if not check(cutlist, rng):
+			failed = failed + 1
+			print(f"{i:5d} DIFFERENT {cutlist.to_json()}")
+	print(f"{args.count} random cutlists, {failed} different")
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,565 @@
+#!/usr/bin/python
+import json
+import csv
+import gzip
+import io
+import os
+import re
+import struct
+from contextlib import nullcontext
+import numpy as np
+from profiling import stage
+
+#Every command the laser controller understands, in the order they are numbered in a cutlist
+OPCODES = ["jump", "mark", "z_abs", "z_rel", "z_step", "c_abs", "c_rel", "c_step",
+		   "a_abs", "a_rel", "a_step", "set_trigger4", "stop_trigger"]
+(JUMP, MARK, Z_ABS, Z_REL, Z_STEP, C_ABS, C_REL, C_STEP,
+ A_ABS, A_REL, A_STEP, SET_TRIGGER4, STOP_TRIGGER) = range(len(OPCODES))
+OPCODE = {name: i for i, name in enumerate(OPCODES)}
+
+#The absolute and relative commands that move each axis
+AXES = {"z": (Z_ABS, (Z_REL, Z_STEP)), "c": (C_ABS, (C_REL, C_STEP)), "a": (A_ABS, (A_REL, A_STEP))}
+
+#The controller is always triggered with the same settings
+TRIGGER4 = ["1", "0", "7", "8", "45"]
+
+#How each number is written back out: f"{v:.6f}", str(float) or str(int). The x field
+#(or value) uses the low two bits of a command's fmt, the y field the next two.
+FIXED, FLOAT, INT = 0, 1, 2
+FORMATTERS = (lambda v: f"{v:.6f}", str, lambda v: str(int(v)))
+
+#Binary cutlists start with MAGIC, then the version and length of a JSON header holding
+#the laser config, padded to 8 bytes. One fixed-width RECORD per command follows.
+MAGIC = b"DFCUTLST"
+VERSION = 1
+RECORD = np.dtype([("op", "u1"), ("fmt", "u1"), ("x", "<f8"), ("y", "<f8"), ("value", "<f8")])
+
+def fmt_of(number):
+	"""
+	This function returns the format that str() would have used for a
+	number taken straight from a configuration file.
+	"""
+	return INT if isinstance(number, int) else FLOAT
+
+def parse_fmt(token):
+	"""
+	This function works out which format a number in an existing cutlist
+	was written with, so that it is rendered back out unchanged.
+	"""
+	number = float(token)
+	if token.lstrip("-").isdigit():
+		return INT
+	elif f"{number:.6f}" == token:
+		return FIXED
+	return FLOAT
+
+class Cutlist:
+	"""
+	A cutlist stored as columns rather than as lists of strings. op holds
+	the command, x and y the coordinates of jumps and marks, and value the
+	argument of a/c/z moves. Strings are only produced by rows(), to_list()
+	and to_json(), at the point the cutlist is written out.
+	"""
+
+	def __init__(self, op=(), x=(), y=(), value=(), fmt=()):
+		self.op = np.asarray(op, dtype=np.uint8)
+		self.x = np.asarray(x, dtype=np.float64)
+		self.y = np.asarray(y, dtype=np.float64)
+		self.value = np.asarray(value, dtype=np.float64)
+		self.fmt = np.asarray(fmt, dtype=np.uint8)
+
+	@classmethod
+	def command(cls, name, value=np.nan, fmt=FIXED):
+		"""
+		Returns a cutlist holding a single non-coordinate command.
+		"""
+		return cls([OPCODE[name]], [np.nan], [np.nan], [value], [fmt])
+
+	@classmethod
+	def points(cls, op, x, y, fmt=FIXED, fmt_y=None):
+		"""
+		Returns a cutlist of jumps and marks, op being an array of JUMP/MARK.
+		"""
+		op = np.asarray(op, dtype=np.uint8)
+		fmt = fmt | ((fmt if fmt_y is None else fmt_y) << 2)
+		return cls(op, x, y, np.full(len(op), np.nan), np.full(len(op), fmt))
+
+	@classmethod
+	def layered(cls, counts, op, x, y, fmt, separator, where="after"):
+		"""
+		Returns a cutlist made of layers of scans. counts holds the number of
+		scans per layer, op the commands making up one scan, and x, y arrays of
+		shape (total scans, len(op)). A copy of the separator command is placed
+		before or after every layer, or only between layers.
+		"""
+		counts = np.asarray(counts, dtype=np.int64)
+		sizes = counts * len(op) + 1
+		starts = np.cumsum(sizes) - sizes
+		separators = starts if where == "before" else starts + counts * len(op)
+		total = int(sizes.sum())
+		if where == "between" and len(counts):
+			separators = separators[:-1]
+			total = total - 1
+
+		is_point = np.ones(total, dtype=bool)
+		is_point[separators] = False
+		cutlist = cls(np.zeros(total), np.full(total, np.nan), np.full(total, np.nan),
+					  np.full(total, np.nan), np.zeros(total))
+		cutlist.op[separators] = separator.op[0]
+		cutlist.value[separators] = separator.value[0]
+		cutlist.fmt[separators] = separator.fmt[0]
+		cutlist.op[is_point] = np.tile(np.asarray(op, dtype=np.uint8), int(counts.sum()))
+		cutlist.x[is_point] = np.ravel(x)
+		cutlist.y[is_point] = np.ravel(y)
+		cutlist.fmt[is_point] = fmt | (fmt << 2)
+		return cutlist
+
+	@classmethod
+	def concat(cls, parts):
+		"""
+		Joins cutlists end to end.
+		"""
+		parts = list(parts)
+		return cls(*[np.concatenate([getattr(p, name) for p in parts]) if parts else ()
+					 for name in ("op", "x", "y", "value", "fmt")])
+
+	def __add__(self, other):
+		return Cutlist.concat([self, other])
+
+	def __len__(self):
+		return len(self.op)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return Cutlist(self.op[index], self.x[index], self.y[index], self.value[index], self.fmt[index])
+		return self.row(index)
+
+	@property
+	def nbytes(self):
+		return self.op.nbytes + self.x.nbytes + self.y.nbytes + self.value.nbytes + self.fmt.nbytes
+
+	def frozen(self):
+		"""
+		Makes the cutlist's arrays read-only, so a cutlist that is cached can
+		be handed out without being changed, and returns it.
+		"""
+		for name in ("op", "x", "y", "value", "fmt"):
+			getattr(self, name).flags.writeable = False
+		return self
+
+	def row(self, i):
+		"""
+		Renders command i as the list of strings the controller expects.
+		"""
+		op, fmt = int(self.op[i]), int(self.fmt[i])
+		if op == JUMP or op == MARK:
+			return [OPCODES[op], FORMATTERS[fmt & 3](float(self.x[i])), FORMATTERS[fmt >> 2](float(self.y[i]))]
+		elif op == SET_TRIGGER4:
+			return [OPCODES[op]] + TRIGGER4
+		elif op == STOP_TRIGGER:
+			return [OPCODES[op]]
+		return [OPCODES[op], FORMATTERS[fmt & 3](float(self.value[i]))]
+
+	def rows(self):
+		"""
+		Yields every command as a list of strings, in order.
+		"""
+		names = OPCODES
+		for op, x, y, value, fmt in zip(self.op.tolist(), self.x.tolist(), self.y.tolist(),
+										self.value.tolist(), self.fmt.tolist()):
+			if op == JUMP or op == MARK:
+				yield [names[op], FORMATTERS[fmt & 3](x), FORMATTERS[fmt >> 2](y)]
+			elif op == SET_TRIGGER4:
+				yield [names[op]] + TRIGGER4
+			elif op == STOP_TRIGGER:
+				yield [names[op]]
+			else:
+				yield [names[op], FORMATTERS[fmt & 3](value)]
+
+	def to_list(self):
+		return list(self.rows())
+
+	def to_records(self):
+		"""
+		Returns the cutlist as an array of binary cutlist records.
+		"""
+		records = np.empty(len(self), dtype=RECORD)
+		for name in RECORD.names:
+			records[name] = getattr(self, name)
+		return records
+
+	def to_json(self):
+		return json.dumps(self.to_list())
+
+	@classmethod
+	def from_list(cls, cutlist):
+		"""
+		Builds a cutlist from the lists of strings used in JSON and CSV files.
+		"""
+		return cls.concat(read_commands(cutlist))
+
+	@classmethod
+	def from_json(cls, json_cutlist):
+		return cls.from_list(json.loads(json_cutlist))
+
+	@classmethod
+	def from_csv(cls, csv_cutlist):
+		return cls.from_list(row for row in csv.reader(io.StringIO(csv_cutlist)) if row)
+
+def read_commands(commands, rows=1 << 16):
+	"""
+	This function parses lists of strings, as used in JSON and CSV files,
+	into cutlists of up to rows commands each, which are yielded as they
+	fill, so commands can be parsed from a stream as they are read.
+	"""
+	op = np.empty(rows, dtype=np.uint8)
+	x, y, value = np.empty(rows), np.empty(rows), np.empty(rows)
+	fmt = np.empty(rows, dtype=np.uint8)
+	i = 0
+	for command in commands:
+		code = OPCODE.get(command[0])
+		if code is None:
+			raise Exception("Unknown command in cutlist: " + str(command[0]))
+		op[i] = code
+		if code == JUMP or code == MARK:
+			x[i] = float(command[1])
+			y[i] = float(command[2])
+			value[i] = np.nan
+			fmt[i] = parse_fmt(command[1]) | (parse_fmt(command[2]) << 2)
+		else:
+			if code == SET_TRIGGER4 and list(command[1:]) != TRIGGER4:
+				raise Exception("Unsupported set_trigger4 settings: " + str(command[1:]))
+			x[i] = np.nan
+			y[i] = np.nan
+			value[i] = float(command[1]) if len(command) > 1 and code != SET_TRIGGER4 else np.nan
+			fmt[i] = parse_fmt(command[1]) if len(command) > 1 and code != SET_TRIGGER4 else FIXED
+		i = i + 1
+		if i == rows:
+			yield Cutlist(op.copy(), x.copy(), y.copy(), value.copy(), fmt.copy())
+			i = 0
+	if i:
+		yield Cutlist(op[:i].copy(), x[:i].copy(), y[:i].copy(), value[:i].copy(), fmt[:i].copy())
+
+def json_commands(text, block=1 << 20):
+	"""
+	This function yields the commands of a JSON cutlist one at a time,
+	reading the open text file block characters at a time, so only the
+	command being parsed is held as strings. Line-delimited JSON, one
+	command per line, is read too.
+	"""
+	decoder = json.JSONDecoder()
+	buffer, pos, eof = "", 0, False
+	nested = None
+	more = True
+	while True:
+		while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+			pos = pos + 1
+		#Keep at least a block ahead, or more when a command is longer than that
+		if not eof and (more or len(buffer) - pos < block):
+			data = text.read(block)
+			eof = not data
+			buffer, pos, more = buffer[pos:] + data, 0, False
+			continue
+		if pos == len(buffer):
+			return
+		if nested is None:
+			#A JSON cutlist is one array of commands, line-delimited JSON one command per line
+			following = buffer[pos + 1:].lstrip(" \t\r\n")
+			if not following and not eof:
+				more = True
+				continue
+			nested = following[:1] in ("[", "]")
+			if nested:
+				pos = pos + 1
+			continue
+		if nested and buffer[pos] == "]":
+			return
+		try:
+			command, pos = decoder.raw_decode(buffer, pos)
+		except json.JSONDecodeError:
+			if eof:
+				raise
+			more = True
+			continue
+		yield command
+
+def read_chunks(source, rows=1 << 16):
+	"""
+	Reads a cutlist from a path or an open file as it is parsed, yielding
+	cutlists of up to rows commands each, so a cutlist of any size can be
+	processed in bounded memory. Binary cutlists are memory mapped, JSON
+	ones, line-delimited or not, and CSV ones, gzipped or not, are parsed
+	as they are read.
+	"""
+	with (open(source, "rb") if not hasattr(source, "read") else nullcontext(source)) as f:
+		if not hasattr(f, "peek") and not hasattr(f, "encoding"):
+			#Without peek the format cannot be told without reading the file
+			cutlist = load(f)
+			for start in range(0, len(cutlist), rows):
+				yield cutlist[start:start + rows]
+			return
+		if hasattr(f, "peek") and f.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+			cutlist = load_binary(f.name)[0]
+			for start in range(0, len(cutlist), rows):
+				yield cutlist[start:start + rows]
+			return
+		if hasattr(f, "peek") and f.peek(2)[:2] == b"\x1f\x8b":
+			f = gzip.GzipFile(fileobj=f)
+		text = f if hasattr(f, "encoding") else io.TextIOWrapper(f, encoding="utf8", newline="")
+		first = text.read(1)
+		while first.isspace():
+			first = text.read(1)
+		rest = io.StringIO(first)
+		if first == "[":
+			commands = json_commands(Chain(rest, text))
+		else:
+			commands = (row for row in csv.reader(Chain(rest, text)) if row)
+		yield from read_commands(commands, rows)
+		if text is not f:
+			text.detach()
+
+class Chain:
+	"""
+	Reads one text file after another, as one.
+	"""
+
+	def __init__(self, *files):
+		self.files = list(files)
+
+	def read(self, size=-1):
+		data = ""
+		while self.files and (size < 0 or len(data) < size):
+			more = self.files[0].read(-1 if size < 0 else size - len(data))
+			if not more:
+				self.files.pop(0)
+			data = data + more
+		return data
+
+	def __iter__(self):
+		#A line may start in one file and end in the next
+		line = ""
+		for f in self.files:
+			for part in f:
+				line = line + part
+				if line.endswith("\n"):
+					yield line
+					line = ""
+		if line:
+			yield line
+
+def axis_positions(cutlist, axis):
+	"""
+	This function returns where an axis ("z", "c" or "a") is after every
+	command of a cutlist. Like the controller, it starts at 0, is set by the
+	axis's absolute command and moved by its relative ones.
+	"""
+	absolute, relative = AXES[axis]
+	moved = np.cumsum(np.where(np.isin(cutlist.op, relative), cutlist.value, 0.0))
+	is_absolute = cutlist.op == absolute
+	#Each position is the last absolute value plus whatever was moved since it
+	last = np.maximum.accumulate(np.where(is_absolute, np.arange(len(cutlist)), -1)) if len(cutlist) else np.zeros(0, dtype=int)
+	base = np.where(is_absolute, cutlist.value - moved, 0.0)
+	return np.where(last >= 0, base[np.maximum(last, 0)], 0.0) + moved
+
+def xy_positions(cutlist, start=(0.0, 0.0)):
+	"""
+	This function returns where the galvo is after every command, starting
+	from start, (0,0) by default, and moved only by jumps and marks.
+	"""
+	is_point = (cutlist.op == JUMP) | (cutlist.op == MARK)
+	last = np.maximum.accumulate(np.where(is_point, np.arange(len(cutlist)), -1)) if len(cutlist) else np.zeros(0, dtype=int)
+	x = np.where(last >= 0, cutlist.x[np.maximum(last, 0)], start[0])
+	y = np.where(last >= 0, cutlist.y[np.maximum(last, 0)], start[1])
+	return x, y
+
+def binary_header(laser):
+	"""
+	Returns the bytes that begin a binary cutlist.
+	"""
+	header = json.dumps({"laser_cut_config": laser, "opcodes": OPCODES}).encode("utf8")
+	header = header + b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+	return MAGIC + struct.pack("<II", VERSION, len(header)) + header
+
+def load_binary(path):
+	"""
+	This function opens a binary cutlist without reading it. The returned
+	cutlist's columns are views of a read-only np.memmap of the file, so it
+	can be sliced straight away however large the job is. Returns the
+	cutlist and the laser config stored in its header.
+	"""
+	with open(path, "rb") as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise Exception("Not a binary cutlist: " + str(path))
+		version, length = struct.unpack("<II", f.read(8))
+		if version != VERSION:
+			raise Exception("Unsupported binary cutlist version: " + str(version))
+		header = json.loads(f.read(length))
+	offset = len(MAGIC) + 8 + length
+	if os.path.getsize(path) == offset:
+		return Cutlist(), header["laser_cut_config"]
+	records = np.memmap(path, dtype=RECORD, mode="r", offset=offset)
+	return Cutlist(**{name: records[name] for name in RECORD.names}), header["laser_cut_config"]
+
+def load(source):
+	"""
+	Loads a cutlist from a path or an open file. Binary cutlists are memory
+	mapped, JSON and CSV ones, gzipped or not, are parsed.
+	"""
+	if hasattr(source, "read"):
+		data = source.read()
+		if isinstance(data, bytes) and data.startswith(MAGIC):
+			return load_binary(source.name)[0]
+	else:
+		with open(source, "rb") as f:
+			binary = f.read(len(MAGIC)) == MAGIC
+		if binary:
+			return load_binary(source)[0]
+		with open(source, "rb") as f:
+			data = f.read()
+	if isinstance(data, bytes):
+		if data.startswith(b"\x1f\x8b"):
+			data = gzip.decompress(data)
+		data = data.decode("utf8")
+	if data.lstrip().startswith("["):
+		return Cutlist.from_json(data)
+	return Cutlist.from_csv(data)
+
+def file_names(names, reserved=()):
+	"""
+	This function returns a file name, without extension, for each name in
+	names. Anything but letters, digits, ".", "-" and "_" is replaced by "_",
+	and leading dots are dropped, so that a name cannot leave the directory
+	it is written to. Names that are the same, ignoring case, or reserved,
+	are numbered so that their files do not overwrite each other.
+	"""
+	used = {name.lower() for name in reserved}
+	for name in names:
+		stem = re.sub(r"[^A-Za-z0-9._-]", "_", str(name)).lstrip(".") or "cutlist"
+		unique, number = stem, 1
+		while unique.lower() in used:
+			number = number + 1
+			unique = f"{stem}_{number}"
+		used.add(unique.lower())
+		yield unique
+
+def as_cutlist(cutlist):
+	"""
+	Accepts a Cutlist, a JSON string or a list of string lists.
+	"""
+	if isinstance(cutlist, Cutlist):
+		return cutlist
+	elif isinstance(cutlist, str):
+		return Cutlist.from_json(cutlist)
+	return Cutlist.from_list(cutlist)
+
+class CutlistWriter:
+	"""
+	Writes a cutlist out one segment at a time, as CSV rows to csv_path, as
+	a JSON array to json_path and as a binary cutlist to binary_path, any of
+	which may be None. The JSON is byte-identical to Cutlist.to_json() of the
+	whole cutlist, and compress gzips the CSV file as it is written. laser is
+	stored in the binary cutlist's header.
+
+	Each file is written under its path with temporary_suffix added, and
+	only renamed to its path once close() has finished it, so that a
+	cutlist whose generation fails is never left behind looking complete.
+	Leaving a with block on an exception, or calling abort(), deletes the
+	temporary files instead.
+	"""
+
+	temporary_suffix = ".part"
+
+	def __init__(self, csv_path=None, json_path=None, compress=False, buffering=1 << 20,
+				 binary_path=None, laser=None):
+		self.csv_file = None
+		self.json_file = None
+		self.binary_file = None
+		self.first = True
+		#(temporary path, path) of every file being written
+		self.paths = []
+		try:
+			if csv_path is not None:
+				if compress:
+					self.csv_file = gzip.open(self.temporary(csv_path), "wt", newline="")
+				else:
+					self.csv_file = open(self.temporary(csv_path), "w", newline="", buffering=buffering)
+				self.csv_writer = csv.writer(self.csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+			if json_path is not None:
+				self.json_file = open(self.temporary(json_path), "w", buffering=buffering)
+				self.json_file.write("[")
+			if binary_path is not None:
+				self.binary_file = open(self.temporary(binary_path), "wb", buffering=buffering)
+				self.binary_file.write(binary_header(laser))
+		except BaseException:
+			self.abort()
+			raise
+
+	def temporary(self, path):
+		self.paths.append((path + self.temporary_suffix, path))
+		return self.paths[-1][0]
+
+	#Commands formatted at once, which bounds the memory the formatted rows take
+	rows_per_write = 1 << 16
+
+	def write(self, segment):
+		if len(segment) == 0:
+			return
+		if self.csv_file is not None or self.json_file is not None:
+			#Each command is formatted once for both the CSV and JSON files
+			for start in range(0, len(segment), self.rows_per_write):
+				with stage("format"):
+					rows = list(segment[start:start + self.rows_per_write].rows())
+				if self.csv_file is not None:
+					with stage("write csv"):
+						self.csv_writer.writerows(rows)
+				if self.json_file is not None:
+					with stage("write json"):
+						if not self.first:
+							self.json_file.write(", ")
+						self.json_file.write(", ".join(map(json.dumps, rows)))
+						self.first = False
+		if self.binary_file is not None:
+			with stage("write binary"):
+				self.binary_file.write(segment.to_records().tobytes())
+
+	def files(self):
+		return [f for f in (self.csv_file, self.json_file, self.binary_file) if f is not None]
+
+	def close(self):
+		"""
+		Finishes the files and renames them to their paths.
+		"""
+		try:
+			if self.json_file is not None:
+				self.json_file.write("]")
+			for f in self.files():
+				f.close()
+		except BaseException:
+			self.abort()
+			raise
+		for temporary, path in self.paths:
+			os.replace(temporary, path)
+		self.paths = []
+
+	def abort(self):
+		"""
+		Closes the files unfinished and deletes them.
+		"""
+		for f in self.files():
+			try:
+				f.close()
+			except OSError:
+				pass
+		for temporary, path in self.paths:
+			if os.path.exists(temporary):
+				os.remove(temporary)
+		self.paths = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
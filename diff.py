@@ -0,0 +1,244 @@
+#!/usr/bin/python
+import argparse
+import json
+import sys
+import numpy as np
+from visualise import replay, layer_labels, mark_starts, transform
+
+#Differences no larger than this, in mm or degrees, are not reported
+tolerance = 1e-3
+
+def segments(cut_list):
+	"""
+	This function replays a cutlist as visualise() does, and returns its
+	marks as segments from where each is cut from (see mark_starts) to the
+	mark, and its layers, runs of points with the same label. Both are dictionaries
+	of arrays: the segments' ends, the a and c set when they are cut and
+	their layer number, and the layers' label and the z, a and c set when
+	they begin.
+	"""
+	points = replay(cut_list)
+	labels, codes = layer_labels(points)
+	layer_start = np.r_[True, codes[1:] != codes[:-1]] if len(codes) else np.zeros(0, dtype=bool)
+	layer = np.cumsum(layer_start) - 1
+	marks, x0, y0, z0 = mark_starts(points)
+	segment = {"x0": x0, "y0": y0, "z0": z0,
+			   "x1": points["x"][marks], "y1": points["y"][marks], "z1": points["z"][marks],
+			   "a": points["a"][marks], "c": points["c"][marks], "layer": layer[marks]}
+	first = np.flatnonzero(layer_start)
+	layers = {"label": [labels[code] for code in codes[first]],
+			  "z": points["z"][first], "a": points["a"][first], "c": points["c"][first]}
+	return segment, layers
+
+def occurrence(keys):
+	"""
+	This function numbers the rows of keys, an (n, k) integer array, by how
+	many identical rows come before them, so that repeated rows can be told
+	apart and matched in order.
+	"""
+	if not len(keys):
+		return np.zeros(0, dtype=np.int64)
+	#lexsort is stable, so identical rows stay in order
+	order = np.lexsort(keys.T[::-1])
+	ordered = keys[order]
+	new = np.r_[True, (ordered[1:] != ordered[:-1]).any(axis=1)]
+	group_start = np.maximum.accumulate(np.where(new, np.arange(len(keys)), 0))
+	rank = np.empty(len(keys), dtype=np.int64)
+	rank[order] = np.arange(len(keys)) - group_start
+	return rank
+
+def match(keys_a, keys_b):
+	"""
+	This function matches the rows of two integer arrays which are the same,
+	repeated rows in order. Returns the index of the matching row in keys_b
+	for every row of keys_a, and in keys_a for every row of keys_b, -1 where
+	there is none.
+	"""
+	keys_a = np.column_stack((keys_a, occurrence(keys_a)))
+	keys_b = np.column_stack((keys_b, occurrence(keys_b)))
+	both = np.concatenate((keys_a, keys_b))
+	matched_a, matched_b = np.full(len(keys_a), -1), np.full(len(keys_b), -1)
+	if not len(both):
+		return matched_a, matched_b
+	#Rows are unique within each side, so a row appearing twice is in both, side a first
+	order = np.lexsort(both.T[::-1])
+	same = np.flatnonzero((both[order[1:]] == both[order[:-1]]).all(axis=1))
+	a, b = order[same], order[same + 1] - len(keys_a)
+	matched_a[a], matched_b[b] = b, a
+	return matched_a, matched_b
+
+def quantise(values, tolerance):
+	return np.round(np.asarray(values, dtype=float) / tolerance).astype(np.int64)
+
+#The ends of a segment, in order
+ends = ("x0", "y0", "z0", "x1", "y1", "z1")
+
+def ordered(segment, tolerance):
+	"""
+	This function returns the ends of segments as an (n, 6) array, and the
+	same quantised to tolerance, with the ends of each segment swapped where
+	needed so that the lower of them, by quantised x, then y, then z, comes
+	first. A segment is the same cut whichever way it is cut, so the ends
+	are compared in this order. Also returns which segments were swapped.
+	"""
+	values = np.column_stack([segment[end] for end in ends]).reshape(-1, 6)
+	keys = quantise(values, tolerance)
+	difference = keys[:,:3] - keys[:,3:]
+	swapped = difference[np.arange(len(keys)), np.argmax(difference != 0, axis=1)] > 0
+	swap = lambda array: np.where(swapped[:,None], np.roll(array, 3, axis=1), array)
+	return swap(values), swap(keys), swapped
+
+def changes(a, b, tolerance=tolerance):
+	"""
+	This function compares two cutlists, each a Cutlist or a path to or open
+	cutlist file. Their layers are aligned by the z, a and c they are cut
+	at, repeated layers in order, and the segments of aligned layers are
+	matched with each other, whichever way they are cut (see ordered()). A
+	segment of b which matches one of a, each end within tolerance, is
+	unchanged, or reversed if it is cut the other way. Otherwise the
+	segments of a layer left unmatched are paired in order: a pair is a
+	segment moved, and any left over were removed from a or added to b.
+
+	Returns the segments and layers of a and b (see segments()), with the
+	aligned layer number of each layer, and for every segment its ends in
+	order (see ordered()), its status, 0 unchanged, 1 removed or added, 2
+	moved or 3 reversed, and the index of the segment it matches or moved
+	to or from on the other side, -1 if none.
+	"""
+	(segments_a, layers_a), (segments_b, layers_b) = segments(a), segments(b)
+	state = [np.column_stack([quantise(layers[axis], tolerance) for axis in ("z", "a", "c")]).reshape(-1, 3)
+			 for layers in (layers_a, layers_b)]
+	aligned = np.unique(np.concatenate([np.column_stack((keys, occurrence(keys))) for keys in state]),
+						axis=0, return_inverse=True)[1].reshape(-1)
+	layers_a["aligned"], layers_b["aligned"] = aligned[:len(state[0])], aligned[len(state[0]):]
+
+	(values_a, keys_a, swapped_a), (values_b, keys_b, swapped_b) = ordered(segments_a, tolerance), ordered(segments_b, tolerance)
+	keys = [np.column_stack((layers["aligned"][segment["layer"]], quantised)).reshape(-1, 7)
+			for segment, layers, quantised in ((segments_a, layers_a, keys_a), (segments_b, layers_b, keys_b))]
+	matched_a, matched_b = match(*keys)
+	status_a, status_b = (matched_a < 0).astype(np.int8), (matched_b < 0).astype(np.int8)
+
+	#What is left of each layer is paired in order
+	left_a, left_b = np.flatnonzero(matched_a < 0), np.flatnonzero(matched_b < 0)
+	paired_a, paired_b = match(keys[0][left_a, :1], keys[1][left_b, :1])
+	pairs_a = left_a[paired_a >= 0]
+	pairs_b = left_b[paired_a[paired_a >= 0]]
+	distance = np.abs(values_a[pairs_a] - values_b[pairs_b]).max(axis=1, initial=0)
+	#Ends just either side of a rounding boundary are within tolerance but not matched above
+	status_a[pairs_a] = status_b[pairs_b] = np.where(distance <= tolerance, 0, 2)
+	matched_a[pairs_a], matched_b[pairs_b] = pairs_b, pairs_a
+
+	#Segments with the same ends, cut the other way
+	same = np.flatnonzero((status_a == 0) & (matched_a >= 0))
+	same = same[swapped_a[same] != swapped_b[matched_a[same]]]
+	status_a[same] = status_b[matched_a[same]] = 3
+	segments_a["ends"], segments_a["status"], segments_a["matched"] = values_a, status_a, matched_a
+	segments_b["ends"], segments_b["status"], segments_b["matched"] = values_b, status_b, matched_b
+	return {"tolerance": tolerance, "a": (segments_a, layers_a), "b": (segments_b, layers_b)}
+
+def summary(found):
+	"""
+	This function reports the changes() found between two cutlists: the
+	number of segments and layers of each, how many segments were added,
+	removed and moved and the furthest move, how many are cut the other
+	way, and for each aligned layer with a segment added, removed or
+	moved, its label and what changed in it, in the order cut.
+	"""
+	(segments_a, layers_a), (segments_b, layers_b) = found["a"], found["b"]
+	moved_a = np.flatnonzero(segments_a["status"] == 2)
+	moved_b = segments_a["matched"][moved_a]
+	distance = np.abs(segments_a["ends"][moved_a] - segments_b["ends"][moved_b]).max(axis=1, initial=0)
+
+	count = max(np.max(layers_a["aligned"], initial=-1), np.max(layers_b["aligned"], initial=-1)) + 1
+	def per_layer(segment, layers, status):
+		return np.bincount(layers["aligned"][segment["layer"][segment["status"] == status]], minlength=count)
+	removed, added = per_layer(segments_a, layers_a, 1), per_layer(segments_b, layers_b, 1)
+	moved, flipped = per_layer(segments_b, layers_b, 2), per_layer(segments_b, layers_b, 3)
+	in_a = np.bincount(layers_a["aligned"], minlength=count) > 0
+	in_b = np.bincount(layers_b["aligned"], minlength=count) > 0
+
+	#Layers are listed in the order b cuts them, then those only in a
+	label = {}
+	for layers in (layers_b, layers_a):
+		for aligned, name in zip(layers["aligned"].tolist(), layers["label"]):
+			label.setdefault(aligned, name)
+	changed = []
+	for aligned, name in label.items():
+		if removed[aligned] or added[aligned] or moved[aligned]:
+			changed.append({"layer": name,
+							"in": "both" if in_a[aligned] and in_b[aligned] else ("a" if in_a[aligned] else "b"),
+							"added": int(added[aligned]), "removed": int(removed[aligned]), "moved": int(moved[aligned]),
+							"reversed": int(flipped[aligned])})
+	return {"tolerance": found["tolerance"],
+			"segments": {"a": len(segments_a["status"]), "b": len(segments_b["status"])},
+			"layers": {"a": len(layers_a["label"]), "b": len(layers_b["label"]),
+					   "only_a": int((in_a & ~in_b).sum()), "only_b": int((in_b & ~in_a).sum())},
+			"added": int(added.sum()), "removed": int(removed.sum()), "moved": int(len(moved_a)),
+			"max_move": float(distance.max(initial=0)), "reversed": int(flipped.sum()),
+			"changed": changed}
+
+def diff(a, b, tolerance=tolerance):
+	"""
+	This function compares two cutlists and returns the summary() of their
+	changes().
+	"""
+	return summary(changes(a, b, tolerance))
+
+def figure(found, context=True):
+	"""
+	This function draws the changes() found between two cutlists on the
+	block, as visualise() does, but only the layers that changed: segments
+	removed from a in red, added to b in green and moved, where they moved
+	to, in orange, with the unchanged segments of those layers in grey if
+	context.
+	"""
+	import plotly.graph_objects as go
+	(segments_a, layers_a), (segments_b, layers_b) = found["a"], found["b"]
+	changed = np.union1d(layers_a["aligned"][segments_a["layer"][np.isin(segments_a["status"], (1, 2))]],
+						 layers_b["aligned"][segments_b["layer"][np.isin(segments_b["status"], (1, 2))]])
+	traces = [("removed", segments_a, layers_a, segments_a["status"] == 1, "red"),
+			  ("added", segments_b, layers_b, segments_b["status"] == 1, "green"),
+			  ("moved", segments_b, layers_b, segments_b["status"] == 2, "orange")]
+	if context:
+		traces.insert(0, ("unchanged", segments_b, layers_b, np.isin(segments_b["status"], (0, 3)), "lightgrey"))
+	fig = go.Figure()
+	for name, segment, layers, selected, colour in traces:
+		index = np.flatnonzero(selected & np.isin(layers["aligned"][segment["layer"]], changed))
+		drawn = []
+		for end in ("0", "1"):
+			drawn.append(transform({"x": segment["x" + end][index], "y": segment["y" + end][index], "z": segment["z" + end][index],
+								   "a": segment["a"][index], "c": segment["c"][index]}))
+		#Each segment is drawn from one end to the other, with NaN between segments
+		line = np.stack((drawn[0], drawn[1], np.full_like(drawn[0], np.nan)), axis=1).reshape(-1, 3)
+		fig.add_trace(go.Scatter3d(x=line[:,0], y=line[:,1], z=line[:,2], mode="lines", name=f"{name} ({len(index)})",
+								   line=dict(color=colour)))
+	fig.update_layout(scene=dict(xaxis_title="x", yaxis_title="y", zaxis_title="z"))
+	return fig
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Compare two cutlists layer by layer.")
+	parser.add_argument("a", help="JSON, CSV or binary cutlist file to compare from")
+	parser.add_argument("b", help="JSON, CSV or binary cutlist file to compare to")
+	parser.add_argument("-t", "--tolerance", type=float, default=tolerance, help="largest difference to ignore, in mm or degrees")
+	parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+	parser.add_argument("--show", action="store_true", help="draw the layers that changed")
+	args = parser.parse_args(argv)
+
+	found = changes(args.a, args.b, args.tolerance)
+	report = summary(found)
+	if args.json:
+		print(json.dumps(report, indent=4))
+	else:
+		print(f"{report['segments']['a']} -> {report['segments']['b']} segments, "
+			  f"{report['layers']['a']} -> {report['layers']['b']} layers "
+			  f"({report['layers']['only_a']} only in a, {report['layers']['only_b']} only in b)")
+		print(f"{report['added']} added, {report['removed']} removed, {report['moved']} moved "
+			  f"(furthest {report['max_move']:g}), {report['reversed']} reversed, {len(report['changed'])} layers changed")
+		for layer in report["changed"]:
+			print(f"  {layer['layer']} [{layer['in']}]: +{layer['added']} -{layer['removed']} ~{layer['moved']}")
+	if args.show and report["changed"]:
+		figure(found).show()
+	return 1 if report["changed"] else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,545 +1,975 @@
-#!/usr/bin/python
-import json
-import sys
-import math
-import numpy as np
-from datetime import datetime
-import csv
-import os.path
-
-#USED FOR TESTING. Read data from file given as argument
-input_file = sys.argv[1]
-f = open(input_file, encoding="utf8")
-
-#save_path = "C:/DFoundry/Df Laser/test_files/"
-save_path = "C:/Users/achen/Documents/DiamondFoundry/tool-pathing/test_data/"
-
-refraction = 1
-
-def offset(x1,y1,x2,y2,magnitude):
-	"""
-	This function helps find coordinates of parallel lines. It uses an 
-	orthogonal vector to work out offsets to calculate coordinates of
-	lines parallel to (x1,y1) -> (x2,y2), with a given magnitude 
-	"""
-	norm = math.sqrt((y2-y1)**2 + (x1-x2)**2) / magnitude
-	offset_x = (y2-y1)/norm
-	offset_y = (x1-x2)/norm
-	return offset_x, offset_y
-
-# def line(x1,y1,x2,y2,z_thickness,laser):
-# 	"""
-# 	This algorithm creates a cut list for a cut of depth z_thickness
-# 	between (x1,y1)->(x2,y2). 
-# 	"""
-# 	#Global variables that are used by all algorithms
-# 	layers = int(z_thickness/laser["z_spacing"])
-
-# 	#Works out offset when beginning on a new layer
-# 	taper = math.tan(math.radians(laser["kerf_angle"]/2)) * laser["z_spacing"]
-# 	taper_x,taper_y = offset(x1,y1,x2,y2,taper)
-
-# 	#Works out offset between each parallel scan on the same layer
-# 	delta_x,delta_y = offset(x1,y1,x2,y2,laser["xy_spacing"])
-
-# 	#Works out maximum offset from starting line, we don't want to exceed this at any point.
-# 	max_taper = math.tan(math.radians(laser["kerf_angle"]/2)) * (z_thickness) * 2
-# 	max_delta_x, max_delta_y = offset(x1,y1,x2,y2,max_taper)
-# 	#max_delta_x, max_delta_y = 2*max_delta_x, 2*max_delta_y
-
-# 	#Loops through each layer, in which we fit as many parallel raster scans as the maximum offset allows
-# 	cutlist = []
-# 	for a in range(layers):
-# 		new_x1,new_x2,new_y1,new_y2 = x1 + a*taper_x, x2 + a*taper_x, y1 + a*taper_y, y2 + a*taper_y
-# 		i = 0
-# 		while abs(new_x1-x1) < abs(max_delta_x) or abs(new_y1-y1) < abs(max_delta_y):
-# 			#This use of i is to reduce the jump distance between individual scans
-# 			if i % 2 == 0:
-# 				cutlist.append(["jump", f"{new_x1:.6f}", f"{new_y1:.6f}"])
-# 				cutlist.append(["mark", f"{new_x2:.6f}", f"{new_y2:.6f}"])
-# 			else:
-# 				cutlist.append(["jump", f"{new_x2:.6f}", f"{new_y2:.6f}"])
-# 				cutlist.append(["mark", f"{new_x1:.6f}", f"{new_y1:.6f}"])
-# 			new_x1,new_x2,new_y1,new_y2 = new_x1 + delta_x, new_x2 + delta_x, new_y1 + delta_y, new_y2 + delta_y
-# 			i = i + 1
-# 		#Having completed one layer, the laser moves down to begin the next layer
-# 		cutlist.append(["z_rel", str(-laser["z_spacing"])])
-# 		max_delta_x = max_delta_x - taper_x
-# 	return json.dumps(cutlist)
-
-def line(x1,y1,x2,y2,z_thickness,laser):
-	"""
-	This algorithm creates a cut list for a cut of depth z_thickness
-	between (x1,y1)->(x2,y2). 
-	"""
-	#Global variables that are used by all algorithms
-	layers = int(z_thickness/laser["z_spacing"])
-
-	#Works out offset when beginning on a new layer
-	taper = math.tan(math.radians(laser["kerf_angle"]/2)) * laser["z_spacing"]
-	taper_x,taper_y = offset(x1,y1,x2,y2,taper)
-
-	#Works out offset between each parallel scan on the same layer
-	delta_x,delta_y = offset(x1,y1,x2,y2,laser["xy_spacing"])
-
-	#Works out maximum offset from starting line, we don't want to exceed this at any point.
-	max_taper = math.tan(math.radians(laser["kerf_angle"]/2)) * (z_thickness) * 2
-	max_delta_x, max_delta_y = offset(x1,y1,x2,y2,max_taper)
-	#max_delta_x, max_delta_y = 2*max_delta_x, 2*max_delta_y
-
-	#Loops through each layer, in which we fit as many parallel raster scans as the maximum offset allows
-	cutlist = []
-	for a in range(layers):
-		new_x1,new_x2,new_y1,new_y2 = x1 + a*taper_x, x2 + a*taper_x, y1 + a*taper_y, y2 + a*taper_y
-		i = 0
-		cutlist.append(["z_step", str(-laser["z_spacing"])])
-		while abs(new_x1-x1) < abs(max_delta_x) or abs(new_y1-y1) < abs(max_delta_y):
-			#This use of i is to reduce the jump distance between individual scans
-			if i % 2 == 0:
-				cutlist.append(["jump", f"{new_x1:.6f}", f"{new_y1:.6f}"])
-				cutlist.append(["mark", f"{new_x2:.6f}", f"{new_y2:.6f}"])
-			else:
-				cutlist.append(["jump", f"{new_x2:.6f}", f"{new_y2:.6f}"])
-				cutlist.append(["mark", f"{new_x1:.6f}", f"{new_y1:.6f}"])
-			new_x1,new_x2,new_y1,new_y2 = new_x1 + delta_x, new_x2 + delta_x, new_y1 + delta_y, new_y2 + delta_y
-			i = i + 1
-		#Having completed one layer, the laser moves down to begin the next layer
-		max_delta_x = max_delta_x - taper_x
-
-	cutlist.insert(0, ["set_trigger4", "1", "0", "7", "8", "45"])
-	cutlist.append(["stop_trigger"])
-	return json.dumps(cutlist)
-
-def z_focus(block,cut,laser):
-	"""
-	This algorithm returns a cutlist which describes a series of parallel lines,
-	each with a different z value, to calibrate the z value for the laser.
-	"""
-	cutlist = []
-	iterations = int(cut["final_dimension_z"]/laser["z_spacing"])
-	#Currently x,y is decided to take up a good amount of the block, rather than having set distances and sizes
-	y = cut["final_dimension_y"]/2
-	offset = laser["xy_spacing"]
-	x = 0
-
-	cutlist.append(["z_abs","0"])
-	for a in range(iterations):
-		cutlist.append(["jump", f"{x:.6f}", f"{y:.6f}"])
-		cutlist.append(["mark", f"{x:.6f}", f"{-y:.6f}"])
-		cutlist.append(["z_rel", str(-laser["z_spacing"])])
-		x = x + offset
-	cutlist.insert(0, ["set_trigger4", "1", "0", "7", "8", "45"])
-	cutlist.append(["stop_trigger"])
-	return json.dumps(cutlist)
-
-
-def simple_core(block,cut,laser):
-	"""
-	This algorithm returns a cutlist which performs a simple core operation.
-	The laser runs race track style around the specified core, going around
-	all 4 sides before the laser moves down to the next layer. The poly is
-	expected to fall off the core at the end of the entire cutting operation.
-	"""
-
-	layers = int(block["thickness"]/laser["z_spacing"])
-
-	#Since all cuts are square, the offsets are more obvious than in the general linear case.
-	taper = math.tan(math.radians(laser["kerf_angle"]/2)) * laser["z_spacing"]
-	max_delta = math.tan(math.radians(laser["kerf_angle"]/2)) * (block["thickness"] + laser["z_final_overshoot"]) * 2
-	
-	cutlist = []
-	cutlist.append(["a_abs", "0"])
-	cutlist.append(["c_abs", str(block["physical_rotation"])])
-	cutlist.append(["z_abs", str(block["thickness"])])
-
-	for a in range(layers):
-		x1, y1 = cut["final_dimension_x"]/2 + a*taper, cut["final_dimension_y"]/2 + a*taper
-		while abs(x1-cut["final_dimension_x"]/2)  < abs(max_delta):
-			cutlist.append(["jump", str(x1 + block["origin_x"]), str(y1 + block["origin_y"])])
-			cutlist.append(["mark", str(x1 + block["origin_x"]), str(-y1 + block["origin_y"])])
-			cutlist.append(["mark", str(-x1 + block["origin_x"]), str(-y1 + block["origin_y"])])
-			cutlist.append(["mark", str(-x1 + block["origin_x"]), str(y1 + block["origin_y"])])
-			cutlist.append(["mark", str(x1 + block["origin_x"]), str(y1 + block["origin_y"])])
-			x1, y1 = x1 + laser["xy_spacing"], y1 + laser["xy_spacing"]
-		cutlist.append(["z_step", str(-laser["z_spacing"])])
-		max_delta = max_delta - taper 
-	return json.dumps(cutlist)
-
-def vertical_core(block,cut,laser):
-	"""
-	This algorithm returns a cutlist which performs a vertical core operation.
-	The laser cuts off one side of poly at a time, rotating the block such that
-	the edge of the laser "cone" is parallel to the SCD core. After one side of
-	the block has been removed, the block is rotated 90 degrees and the algorithm
-	repeats until all 4 sides have been removed.
-	"""
-
-	layers = int(block["thickness"]/laser["z_spacing"])
-	angle = math.radians(laser["kerf_angle"]/2)
-	taper = math.tan(angle) * laser["z_spacing"]
-
-	u = math.tan(2 * angle) * (block["thickness"] + laser["z_final_overshoot"])
-	z_0 = block["thickness"]*math.cos(angle) + math.sin(angle)*((cut["final_dimension_y"])/2 - block["origin_y"] + u)
-	z_1 = block["thickness"]*math.cos(angle) + math.sin(angle)*((cut["final_dimension_x"])/2 + block["origin_x"] + u)
-	z_2 = block["thickness"]*math.cos(angle) + math.sin(angle)*((cut["final_dimension_y"])/2 + block["origin_y"] + u)
-	z_3 = block["thickness"]*math.cos(angle) + math.sin(angle)*((cut["final_dimension_x"])/2 - block["origin_x"] + u)
-	
-	cutlist = []
-	cutlist.append(["a_abs", f"{math.degrees(angle):.6f}"])
-	cutlist.append(["c_abs", str(block["physical_rotation"])])
-	cutlist.append(["z_abs", f"{z_0:.6f}"])
-
-	y_start_wide = ((u + cut["final_dimension_x"]/2)* math.cos(angle) 
-				 - block["thickness"]*math.sin(angle) 
-				 - u/math.cos(angle))
-	y_start_length = ((u + cut["final_dimension_y"]/2)* math.cos(angle) 
-				   - block["thickness"]*math.sin(angle) 
-				   - u/math.cos(angle))
-
-	depth_cut = (block["thickness"] + laser["z_final_overshoot"]) * math.cos(angle)/math.cos(2*angle)
-
-	cut1 = json.loads(line(block["width"]/2 - block["origin_x"],y_start_length - block["origin_y"],-block["width"]/2 - block["origin_x"],y_start_length - block["origin_y"],depth_cut,laser))
-
-	cut2 = json.loads(line(block["length"]/2 + block["origin_y"],y_start_wide - block["origin_x"],-block["length"]/2 + block["origin_y"],y_start_wide - block["origin_x"],depth_cut,laser))
-
-	cut3 = json.loads(line(block["width"]/2 + block["origin_x"],y_start_length + block["origin_y"],-block["width"]/2 + block["origin_x"],y_start_length + block["origin_y"],depth_cut,laser))
-
-	cut4 = json.loads(line(block["length"]/2 - block["origin_y"],y_start_wide + block["origin_x"],-block["length"]/2 - block["origin_y"],y_start_wide + block["origin_x"],depth_cut,laser))
-
-	#cut1 = json.loads(line(block["width"]/2,y_start_length,-block["width"]/2,y_start_length,depth_cut,laser))
-
-	#cut2 = json.loads(line(block["length"]/2,y_start_wide,-cut["final_dimension_y"]/2,y_start_wide,depth_cut,laser))
-
-	#cut3 = json.loads(line(block["width"]/2,y_start_length,-cut["final_dimension_x"]/2,y_start_length,depth_cut,laser))
-
-	#cut4 = json.loads(line(cut["final_dimension_y"]/2,y_start_wide,-cut["final_dimension_y"]/2,y_start_wide,depth_cut,laser))
-
-	cutlist = (cutlist + cut1
-	                   + [["c_rel", "90"],["z_abs", f"{z_1:.6f}"],] 
-	                   + cut2
-	                   + [["c_rel", "90"],["z_abs", f"{z_2:.6f}"]] 
-					   + cut3 
-					   + [["z_abs", f"{z_3:.6f}"],["c_rel", "90"]] 
-					   + cut4)
-
-	cutlist.insert(0, ["set_trigger4", "1", "0", "7", "8", "45"])
-	cutlist.append(["stop_trigger"])
-
-	return json.dumps(cutlist)
-
-
-def pyramid_slice(x1,y1,x2,y2,z,delta,deltaz,taper_x,taper_y,taper_straight,layers):
-	"""
-	This algorithm returns a cutlist which performs a cut which is a quarter
-	of the total slicing required to create a pyramid top, while ensuring a flat
-	bottom above it, both of which is required for an OG seed.
-	"""
-	cutlist = []
-	y_max = abs(y1-y2)
-	for a in range(layers):
-		i = 0
-		new_x1, new_y1, new_x2, new_y2 = x1 - a*taper_x, y1-a*taper_straight, x2+a*taper_x, y2+a*taper_y
-		while abs(new_y1 - (y1 - a*taper_straight)) < y_max and x1 > 0:
-			if i % 2 == 0:
-				cutlist.append(["jump", f"{new_x1:.6f}", f"{new_y1:.6f}"])
-				cutlist.append(["mark", f"{new_x2:.6f}", f"{new_y1:.6f}"])
-			else:
-				cutlist.append(["jump", f"{new_x2:.6f}", f"{new_y1:.6f}"])
-				cutlist.append(["mark", f"{new_x1:.6f}", f"{new_y1:.6f}"])
-			new_y1 = new_y1-delta
-			i = i + 1
-		if a < layers - 1:
-			cutlist.append(["z_step", str(-deltaz)])
-		y_max = y_max - taper_straight - taper_y
-
-	return cutlist
-
-# def oss_stacked(block, cut, laser):
-# 	"""
-# 	This algorithm returns a cutlist which performs OG slicing. It begins
-# 	with an optional core, then cuts out slices until as many OG seeds as 
-# 	specified are removed from the block.
-# 	"""
-# 	pyramid_angle_1 = math.atan(cut["pyramid_height"]/(cut["final_dimension_x"]/2))
-# 	pyramid_angle_2 = math.atan(cut["pyramid_height"]/(cut["final_dimension_y"]/2))
-
-# 	angle = math.radians(laser["kerf_angle"]/2)
-# 	gap = math.tan(pyramid_angle_1) * (cut["final_dimension_x"]/2) + cut["gap_size"]
-# 	unit_length = gap + cut["base_height"]
-# 	max_slices = math.floor(block["thickness"]/unit_length)
-
-# 	if cut["core"] == "yes":
-# 		cutlist = json.loads(vertical_core(block,cut,laser))
-# 		return json.dumps(cutlist)
-# 	else:
-# 		cutlist = []
-
-# 	a0 = -(90 + math.degrees(angle))
-
-# 	if cut["excess"] == "top":
-# 		#Cut out of bottom_up
-# 		side_x = unit_length * max_slices-cut["pyramid_height"]
-# 	elif cut["excess"] == "bottom":
-# 		#Cut out of top
-# 		side_x = block["thickness"]-cut["pyramid_height"]
-
-# 	diagonal_1 = math.sqrt(side_x**2 + (cut["final_dimension_x"]/2)**2)
-# 	theta_1 = math.atan(side_x*2/cut["final_dimension_x"])
-# 	z0_1 = math.cos(theta_1 + angle) * diagonal_1
-
-# 	diagonal_2 = math.sqrt(side_x**2 + (cut["final_dimension_y"]/2)**2)
-# 	theta_2 = math.atan(side_x*2/cut["final_dimension_y"])
-# 	z0_2 = math.cos(theta_2 + angle) * diagonal_2
-
-
-# 	x1_1 = math.sin(theta_1 + angle) * diagonal_1
-# 	x1_2 = math.sin(theta_2 + angle) * diagonal_2
-# 	x_offset = gap/math.cos(angle)
-# 	x0_1 = x1_1 + x_offset
-# 	x0_2 = x1_2 + x_offset
-
-# 	z_shift = (cut["base_height"] + gap) * math.sin(angle)
-# 	x_shift = (cut["base_height"] + gap) * math.cos(angle)
-
-# 	cutlist.append(["a_abs",f"{a0:.6f}"])
-# 	cutlist.append(["c_abs",str(block["physical_rotation"])])
-# 	cutlist.append(["z_abs",f"{z0_1:.6f}"])
-
-# 	if pyramid_angle_1 >= angle and pyramid_angle_2 >= angle:
-# 		max_depth_1 = ((cut["pyramid_height"]/math.sin(pyramid_angle_1))*math.cos(angle))*refraction
-# 		max_layers_1 = math.ceil(max_depth_1/laser["z_spacing"])
-# 		max_depth_2 = ((cut["pyramid_height"]/math.sin(pyramid_angle_2))*math.cos(angle))*refraction
-# 		max_layers_2 = math.ceil(max_depth_2/laser["z_spacing"])
-
-# 		if cut["layers"] == "max":
-# 			layers_1 = max_layers_1 + 1
-# 			layers_2 = max_layers_2 + 1
-# 		else:
-# 			layers_1 = cut["layers"]
-# 			layers_2 = cut["layers"]
-
-# 		new_angle_1 = math.atan((math.tan(pyramid_angle_1))/refraction)
-# 		taper_y_1 = math.tan(new_angle_1 - angle)*(laser["z_spacing"])
-# 		taper_x_1 = cut["final_dimension_x"]/(2*max_layers_1)
-# 		new_angle_2 = math.atan((math.tan(pyramid_angle_2))/refraction)
-# 		taper_y_2 = math.tan(new_angle_2 - angle)*(laser["z_spacing"])
-# 		taper_x_2 = cut["final_dimension_x"]/(2*max_layers_2)
-# 		taper_straight = math.tan(angle)*(laser["z_spacing"])
-
-# 		if cut["num_of_seeds"] == "max":
-# 			num_slices = max_slices
-# 		else:
-# 			num_slices = cut["num_of_seeds"] + 1
-
-# 		for i in range(num_slices):
-# 			cutlist = (cutlist
-# 						  + pyramid_slice(cut["final_dimension_y"]/2,x0_1,-cut["final_dimension_y"]/2,x1_1,z0_1,laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1)
-# 						  + [["z_abs",f"{z0_2:.6f}"]] + [["c_abs","90"]]
-# 						  + pyramid_slice(cut["final_dimension_x"]/2,x0_2,-cut["final_dimension_x"]/2,x1_2,z0_2,laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)
-# 						  + [["z_abs",f"{z0_1:.6f}"]] + [["c_abs","180"]]
-# 						  + pyramid_slice(cut["final_dimension_y"]/2,x0_1,-cut["final_dimension_y"]/2,x1_1,z0_1,laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1)
-# 						  + [["z_abs",f"{z0_2:.6f}"]] + [["c_abs","270"]]
-# 						  + pyramid_slice(cut["final_dimension_x"]/2,x0_2,-cut["final_dimension_x"]/2,x1_2,z0_2,laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)
-# 						  )
-# 			z0_1 = z0_1 + z_shift
-# 			z0_2 = z0_2 + z_shift
-# 			x0_1, x1_1, x0_2, x1_2 = x0_1 - x_shift, x1_1 - x_shift, x0_2 - x_shift, x1_2 - x_shift
-# 			cutlist.append(["c_abs",str(block["physical_rotation"])])
-# 			cutlist.append(["z_abs",f"{z0_1:.6f}"])	
-# 	else:
-# 		raise Exception("Pyramid angle too small")
-
-# 	return json.dumps(cutlist)
-
-def oss_helper(block, cut, laser, x):
-	pyramid_angle_1 = math.atan(cut["pyramid_height"]/x)
-	angle = math.radians(laser["kerf_angle"]/2)
-
-	gap = math.tan(pyramid_angle_1) * (x) + cut["gap_size"]
-	unit_length = gap + cut["base_height"]
-	max_slices = math.floor(block["thickness"]/unit_length)
-
-	if cut["excess"] == "top":
-		#Cut out of bottom_up
-		side_x = unit_length * max_slices-cut["pyramid_height"]
-	elif cut["excess"] == "bottom":
-		#Cut out of top
-		side_x = block["thickness"]-cut["pyramid_height"]
-
-	diagonal_1 = math.sqrt(side_x**2 + x**2)
-	theta_1 = math.atan(side_x/x)
-	z0_1 = math.cos(theta_1 + angle) * diagonal_1
-
-	x1_1 = math.sin(theta_1 + angle) * diagonal_1
-	x_offset = gap/math.cos(angle)
-	x0_1 = x1_1 + x_offset
-
-	max_depth_1 = ((cut["pyramid_height"]/math.sin(pyramid_angle_1))*math.cos(angle))*refraction
-	max_layers_1 = math.ceil(max_depth_1/laser["z_spacing"])
-
-	if cut["layers"] == "max":
-		layers_1 = max_layers_1 + 1
-	else:
-		layers_1 = cut["layers"]
-
-	new_angle_1 = math.atan((math.tan(pyramid_angle_1))/refraction)
-	taper_y_1 = math.tan(new_angle_1 - angle)*(laser["z_spacing"])
-	taper_x_1 = cut["final_dimension_x"]/(2*max_layers_1)
-
-	return x0_1, x1_1, z0_1, taper_x_1, taper_y_1, layers_1, pyramid_angle_1
-
-
-def oss_stacked(block, cut, laser):
-	"""
-	This algorithm returns a cutlist which performs OG slicing. It begins
-	with an optional core, then cuts out slices until as many OG seeds as 
-	specified are removed from the block.
-	"""
-	x0_1, x1_1, z0_1, taper_x_1, taper_y_1, layers_1, pyramid_angle_1 = oss_helper(block, cut, laser, cut["final_dimension_x"]/2)
-	x0_2, x1_2, z0_2, taper_x_2, taper_y_2, layers_2, pyramid_angle_2 = oss_helper(block, cut, laser, cut["final_dimension_y"]/2)
-	angle = math.radians(laser["kerf_angle"]/2)
-	gap = math.tan(pyramid_angle_1) * (cut["final_dimension_x"]/2) + cut["gap_size"]
-	unit_length = gap + cut["base_height"]
-	max_slices = math.floor(block["thickness"]/unit_length)
-	taper_straight = math.tan(angle)*(laser["z_spacing"])
-
-	if cut["core"] == "yes":
-		cutlist = json.loads(vertical_core(block,cut,laser))
-		cutlist.pop()
-		cutlist.pop(0)
-	else:
-		cutlist = []
-
-	a0 = -(90 + math.degrees(angle))
-
-	z_shift = (cut["base_height"] + gap) * math.sin(angle)
-	x_shift = (cut["base_height"] + gap) * math.cos(angle)
-
-	x_delta = math.sin(angle) * block["origin_x"]
-	y_delta = math.sin(angle) * block["origin_y"]
-	z1_delta = math.cos(angle) * block["origin_x"]
-	z2_delta = math.cos(angle) * block["origin_y"]
-
-	cutlist.append(["a_abs",f"{a0:.6f}"])
-	cutlist.append(["c_abs",str(block["physical_rotation"])])
-	cutlist.append(["z_abs",str(z0_1 + z2_delta)])
-
-	if pyramid_angle_1 >= angle and pyramid_angle_2 >= angle:
-
-		if cut["num_of_seeds"] == "max":
-			num_slices = max_slices
-		else:
-			num_slices = cut["num_of_seeds"] + 1
-		
-		for i in range(num_slices):
-			cutlist = (cutlist
-						  + pyramid_slice(cut["final_dimension_y"]/2 - block["origin_x"],x0_1 + y_delta,-cut["final_dimension_y"]/2 - block["origin_x"],x1_1 + y_delta,z0_1 + block["origin_y"],laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1)
-						  + [["z_abs",str(z0_2 + z1_delta)]] + [["c_abs","90"]]
-						  + pyramid_slice(cut["final_dimension_x"]/2 + block["origin_y"],x0_2 + x_delta,-cut["final_dimension_x"]/2 + block["origin_y"],x1_2 + x_delta,z0_2 + block["origin_x"],laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)
-						  + [["z_abs",str(z0_1 - z2_delta)]] + [["c_abs","180"]]
-						  + pyramid_slice(cut["final_dimension_y"]/2 + block["origin_x"],x0_1 - y_delta,-cut["final_dimension_y"]/2 + block["origin_x"],x1_1 - y_delta,z0_1 - block["origin_y"],laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1)
-						  + [["z_abs",str(z0_2 - z1_delta)]] + [["c_abs","270"]]
-						  + pyramid_slice(cut["final_dimension_x"]/2 - block["origin_y"],x0_2 - x_delta,-cut["final_dimension_x"]/2 - block["origin_y"],x1_2 - x_delta,z0_2 - block["origin_x"],laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)
-						  )
-			z0_1 = z0_1 + z_shift
-			z0_2 = z0_2 + z_shift
-			x0_1, x1_1, x0_2, x1_2 = x0_1 - x_shift, x1_1 - x_shift, x0_2 - x_shift, x1_2 - x_shift
-			cutlist.append(["c_abs",str(block["physical_rotation"])])
-			cutlist.append(["z_abs",str(z0_1 + z2_delta)])	
-	else:
-		raise Exception("Pyramid angle too small")
-
-	cutlist.insert(0, ["set_trigger4", "1", "0", "7", "8", "45"])
-	cutlist.append(["stop_trigger"])
-	return json.dumps(cutlist)
-
-def cross(block, cut, laser):
-	cutlist = []
-	for i in range(1,5):
-		cutlist.append(["jump", "0", str(i/4)])
-		cutlist.append(["mark", "0", str(-i/4)])
-		cutlist.append(["jump", str(i/4), "0"])
-		cutlist.append(["mark", str(-i/4), "0"])
-		if i < 4:
-			cutlist.append(["c_rel", "90"])
-	return json.dumps(cutlist)
-
-def time_taken(json_cutlist, laser):
-	"""
-	This algorithm takes a cutlist and returns an estimate for the time
-	taken to execute this algorithm in hours:minutes:seconds, based on	jump and mark speeds as well as experimental data on how long a,c,z 
-	transformations take.
-	"""
-	cutlist = json.loads(json_cutlist)
-	time = 0
-	coordinate_array = [0, 0]
-	for a in cutlist:
-		if a[0] == "jump" or a[0] == "mark":
-			coordinate_array = [float(a[1]) - coordinate_array[0], float(a[2]) - coordinate_array[1]]
-			mag = math.sqrt(coordinate_array[0]**2 + coordinate_array[1]**2)
-			if a[0] == "jump":
-				time += mag/laser["jump_speed"]
-			else:
-				time += mag/laser["mark_speed"]
-			coordinate_array = [float(a[1]), float(a[2])]
-		elif a[0] == "z_abs" or a[0] == "z_rel":
-			zSet = float(a[1])
-		elif a[0] == "c_abs" or a[0] == "c_rel":
-			cSet = float(a[1])
-		elif a[0] == "a_abs" or a[0] == "a_rel":
-			aSet = float(a[1])
-		else:
-			pass
-	return str(datetime.timedelta(seconds=int(time)))
-
-def generateCutList(cut_configuration):
-	"""
-	This function takes a cut_configuration json object and calls the function
-	corresponding to the desired cut, thereby returning the cutlist.
-	"""
-	#Check that this line reads json.loads(cut_configuration)
-	input_json = json.load(cut_configuration)
-
-	#Currently only desired_cut and laser_cut_config are required
-	try:
-		block = input_json["block"]
-	except:
-		pass
-	try:
-		cut = input_json["desired_cut"]
-		laser = input_json["laser_cut_config"]
-	except:
-		raise Exception("Either desired_cut or laser_cut_config not provided")
-
-	if cut["cut_process"] == "line":
-		final_list = line(cut["x1"],cut["y1"],cut["x2"],cut["y2"],cut["final_dimension_z"]+laser["z_final_overshoot"],laser)
-	elif cut["cut_process"] == "simple_core":
-		final_list = simple_core(block,cut,laser)
-	elif cut["cut_process"] == "vertical_core":
-		final_list = vertical_core(block,cut,laser)
-	elif cut["cut_process"] == "oss_stacked":
-		final_list = oss_stacked(block,cut,laser)
-	elif cut["cut_process"] == "z_focus":
-		final_list = z_focus(block,cut,laser)
-	elif cut["cut_process"] == "cross":
-		final_list = cross(block,cut,laser)
-	else:
-		raise Exception("No such cut exists: Check cut_process")
-	#print(time_taken(final_list, laser))
-	now = datetime.now()
-	timestamp = str(now.strftime("%m-%d_%H_%M"))
-	complete_name = os.path.join(save_path, timestamp+".csv")
-	with open(complete_name, mode='w',newline ='') as test_data:
-	    data_writer = csv.writer(test_data, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-	    list_data = json.loads(final_list)
-	    for line1 in list_data:
-	    	data_writer.writerow(line1)
-	return final_list
-
-#Also used for testing
-data = generateCutList(f)
-test = open ("test.txt","w")
-test.write(data)
-
-
+#!/usr/bin/python
+import contextvars
+import json
+import sys
+import math
+import numpy as np
+from cutlist import Cutlist, CutlistWriter, as_cutlist, axis_positions, xy_positions, fmt_of, OPCODES, AXES, FIXED, FLOAT, INT
+from cutlist import JUMP, MARK, Z_ABS, Z_REL, Z_STEP, C_ABS, C_REL, C_STEP, A_ABS, A_REL, A_STEP, SET_TRIGGER4, STOP_TRIGGER
+from optimise import optimise_segments, peephole_segments
+from validate import validated
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque, namedtuple, OrderedDict
+from functools import lru_cache, wraps
+from contextlib import nullcontext
+import threading
+import profiling
+import os.path
+
+#save_path = "C:/DFoundry/Df Laser/test_files/"
+save_path = "C:/Users/achen/Documents/DiamondFoundry/tool-pathing/test_data/"
+
+refraction = 1
+
+#Layers laid out per segment, which bounds the memory a generator needs at once
+layer_chunk = 256
+
+#Entries kept by the caches of derived geometry and of generated segments. Segments
+#can be large, so fewer of them are kept. Keys are typed, as 1 and 1.0 are written
+#differently. See cache_info() and cache_clear().
+geometry_cache_size = 256
+segment_cache_size = 64
+#Bytes of segments each segment cache keeps at most (see Cutlist.nbytes), so that streaming
+#a large cut does not keep the whole cutlist alive in the cache
+segment_cache_bytes = 4 << 20
+#oss_stacked() cuts whose seeds are kept for incremental regeneration
+seed_cache_size = 4
+
+#Estimated time for the stage to make a move, in ms: a settle time plus the time per
+#mm (z) or degree (a, c) travelled, and the time to set or stop the trigger. These can
+#be replaced by measured values through laser["axis_times"].
+axis_times = {"z": {"settle": 50, "per_unit": 100},
+			  "c": {"settle": 100, "per_unit": 11},
+			  "a": {"settle": 100, "per_unit": 11},
+			  "trigger": 5}
+
+def offset(x1,y1,x2,y2,magnitude):
+	"""
+	This function helps find coordinates of parallel lines. It uses an 
+	orthogonal vector to work out offsets to calculate coordinates of
+	lines parallel to (x1,y1) -> (x2,y2), with a given magnitude 
+	"""
+	norm = math.sqrt((y2-y1)**2 + (x1-x2)**2) / magnitude
+	offset_x = (y2-y1)/norm
+	offset_y = (x1-x2)/norm
+	return offset_x, offset_y
+
+# def line(x1,y1,x2,y2,z_thickness,laser):
+# 	"""
+# 	This algorithm creates a cut list for a cut of depth z_thickness
+# 	between (x1,y1)->(x2,y2). 
+# 	"""
+# 	#Global variables that are used by all algorithms
+# 	layers = int(z_thickness/laser["z_spacing"])
+
+# 	#Works out offset when beginning on a new layer
+# 	taper = math.tan(math.radians(laser["kerf_angle"]/2)) * laser["z_spacing"]
+# 	taper_x,taper_y = offset(x1,y1,x2,y2,taper)
+
+# 	#Works out offset between each parallel scan on the same layer
+# 	delta_x,delta_y = offset(x1,y1,x2,y2,laser["xy_spacing"])
+
+# 	#Works out maximum offset from starting line, we don't want to exceed this at any point.
+# 	max_taper = math.tan(math.radians(laser["kerf_angle"]/2)) * (z_thickness) * 2
+# 	max_delta_x, max_delta_y = offset(x1,y1,x2,y2,max_taper)
+# 	#max_delta_x, max_delta_y = 2*max_delta_x, 2*max_delta_y
+
+# 	#Loops through each layer, in which we fit as many parallel raster scans as the maximum offset allows
+# 	cutlist = []
+# 	for a in range(layers):
+# 		new_x1,new_x2,new_y1,new_y2 = x1 + a*taper_x, x2 + a*taper_x, y1 + a*taper_y, y2 + a*taper_y
+# 		i = 0
+# 		while abs(new_x1-x1) < abs(max_delta_x) or abs(new_y1-y1) < abs(max_delta_y):
+# 			#This use of i is to reduce the jump distance between individual scans
+# 			if i % 2 == 0:
+# 				cutlist.append(["jump", f"{new_x1:.6f}", f"{new_y1:.6f}"])
+# 				cutlist.append(["mark", f"{new_x2:.6f}", f"{new_y2:.6f}"])
+# 			else:
+# 				cutlist.append(["jump", f"{new_x2:.6f}", f"{new_y2:.6f}"])
+# 				cutlist.append(["mark", f"{new_x1:.6f}", f"{new_y1:.6f}"])
+# 			new_x1,new_x2,new_y1,new_y2 = new_x1 + delta_x, new_x2 + delta_x, new_y1 + delta_y, new_y2 + delta_y
+# 			i = i + 1
+# 		#Having completed one layer, the laser moves down to begin the next layer
+# 		cutlist.append(["z_rel", str(-laser["z_spacing"])])
+# 		max_delta_x = max_delta_x - taper_x
+# 	return json.dumps(cutlist)
+
+def scan_offsets(start, delta, layers, n):
+	"""
+	This function returns a (layers, n) array of scan positions. Row a begins
+	at start[a] and each following scan adds delta, accumulated one step at a
+	time so that every value matches the original while loop bit for bit.
+	"""
+	steps = np.empty((layers, n))
+	steps[:,:1] = np.reshape(start, (-1, 1))
+	steps[:,1:] = delta
+	return np.cumsum(steps, axis=1)
+
+def raster(n, layout):
+	"""
+	This function works out how many scans fit in each layer. layout(n) lays
+	out n scans for every layer and returns which of them are inside the
+	layer's limits, along with the scan positions. n is doubled until every
+	layer stops short of it. As in the original loops, a layer ends at its
+	first scan outside the limits.
+	"""
+	while True:
+		inside, scans = layout(n)
+		if not inside[:,-1].any():
+			return np.argmin(inside, axis=1), scans
+		n = n * 2
+
+def serpentine(counts, start_x, start_y, end_x, end_y):
+	"""
+	This function returns the jump and mark coordinates of every scan as
+	(scans, 2) arrays, running every other scan in a layer backwards to
+	reduce the jump distance between individual scans.
+	"""
+	scan = np.arange(np.broadcast_shapes(*[np.shape(v) for v in (start_x, start_y, end_x, end_y)])[1])
+	valid = scan < counts[:,None]
+	forward = np.broadcast_to(scan % 2 == 0, valid.shape)[valid][:,None]
+	start_x, start_y, end_x, end_y = [np.broadcast_to(v, valid.shape)[valid] for v in (start_x, start_y, end_x, end_y)]
+	x = np.where(forward, np.stack((start_x, end_x), axis=1), np.stack((end_x, start_x), axis=1))
+	y = np.where(forward, np.stack((start_y, end_y), axis=1), np.stack((end_y, start_y), axis=1))
+	return x, y
+
+def triggered(segments):
+	"""
+	Wraps segments in the set_trigger4/stop_trigger pair. The *_segments
+	generators below yield their cutlist in pieces without the trigger, and
+	it is added once by whichever function puts the final cutlist together.
+	"""
+	yield Cutlist.command("set_trigger4")
+	yield from segments
+	yield Cutlist.command("stop_trigger")
+
+def parallel(tasks, workers=None, processes=False):
+	"""
+	This function calls each task, a (function, args) pair, and yields the
+	results in the order of tasks. With workers, up to that many tasks run
+	at once on a thread pool, or on a process pool if processes is set, with
+	a few more queued so the pool is never idle. Without, each task is only
+	called once its result is needed.
+	"""
+	if not workers or workers == 1:
+		for function, args in tasks:
+			yield function(*args)
+		return
+	pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+	try:
+		pending = deque()
+		for function, args in tasks:
+			#Threads run each task in a copy of this context, so that it records into this job's trace
+			pending.append(pool.submit(function, *args) if processes else pool.submit(contextvars.copy_context().run, function, *args))
+			if len(pending) > 2 * workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+	finally:
+		pool.shutdown(cancel_futures=True)
+
+SegmentCacheInfo = namedtuple("SegmentCacheInfo", ["hits", "misses", "maxsize", "currsize", "maxbytes", "currbytes"])
+
+def segment_cache(maxsize, maxbytes):
+	"""
+	A typed lru_cache for functions returning read-only Cutlists, which keeps
+	at most maxsize of them and maxbytes between them, dropping the least
+	recently used first. A Cutlist larger than maxbytes is not cached.
+	"""
+	def decorator(function):
+		entries = OrderedDict()
+		lock = threading.Lock()
+		stats = {"hits": 0, "misses": 0, "bytes": 0}
+
+		@wraps(function)
+		def wrapper(*args):
+			key = args + tuple(type(arg) for arg in args)
+			with lock:
+				if key in entries:
+					entries.move_to_end(key)
+					stats["hits"] = stats["hits"] + 1
+					return entries[key]
+				stats["misses"] = stats["misses"] + 1
+			result = function(*args)
+			if result.nbytes > maxbytes:
+				return result
+			with lock:
+				if key not in entries:
+					entries[key] = result
+					stats["bytes"] = stats["bytes"] + result.nbytes
+				while len(entries) > maxsize or stats["bytes"] > maxbytes:
+					stats["bytes"] = stats["bytes"] - entries.popitem(last=False)[1].nbytes
+			return result
+
+		def cache_info():
+			with lock:
+				return SegmentCacheInfo(stats["hits"], stats["misses"], maxsize, len(entries), maxbytes, stats["bytes"])
+
+		def cache_clear():
+			with lock:
+				entries.clear()
+				stats.update(hits=0, misses=0, bytes=0)
+
+		wrapper.cache_info, wrapper.cache_clear = cache_info, cache_clear
+		return wrapper
+	return decorator
+
+def line(x1,y1,x2,y2,z_thickness,laser):
+	"""
+	This algorithm creates a cut list for a cut of depth z_thickness
+	between (x1,y1)->(x2,y2).
+	"""
+	return Cutlist.concat(triggered(line_segments(x1,y1,x2,y2,z_thickness,laser)))
+
+def line_segments(x1,y1,x2,y2,z_thickness,laser):
+	"""
+	Yields the cutlist of line(), layer_chunk layers at a time. Each chunk's
+	scans are computed at once with NumPy, in the same order as the original
+	loop, and cached by line_chunk().
+	"""
+	layers = int(z_thickness/laser["z_spacing"])
+	for first in range(0, layers, layer_chunk):
+		yield line_chunk(x1,y1,x2,y2,z_thickness,laser["z_spacing"],laser["kerf_angle"],laser["xy_spacing"],first,layer_chunk)
+
+@lru_cache(maxsize=geometry_cache_size, typed=True)
+@profiling.timed("geometry")
+def line_geometry(x1,y1,x2,y2,z_thickness,z_spacing,kerf_angle,xy_spacing):
+	"""
+	This function works out the number of layers of a line() cut, the
+	offsets between its layers and scans, and the furthest each layer's
+	scans may go from the starting line.
+	"""
+	#Global variables that are used by all algorithms
+	layers = int(z_thickness/z_spacing)
+
+	#Works out offset when beginning on a new layer
+	taper = math.tan(math.radians(kerf_angle/2)) * z_spacing
+	taper_x,taper_y = offset(x1,y1,x2,y2,taper)
+
+	#Works out offset between each parallel scan on the same layer
+	delta_x,delta_y = offset(x1,y1,x2,y2,xy_spacing)
+
+	#Works out maximum offset from starting line, we don't want to exceed this at any point.
+	max_taper = math.tan(math.radians(kerf_angle/2)) * (z_thickness) * 2
+	max_delta_x, max_delta_y = offset(x1,y1,x2,y2,max_taper)
+
+	#Each layer starts a*taper along the offset, and its x limit shrinks by taper_x per layer
+	all_max_deltas_x = np.cumsum(np.concatenate(([max_delta_x], np.full(max(layers - 1, 0), -taper_x))))[:layers]
+	all_max_deltas_x.flags.writeable = False
+	return layers, taper_x, taper_y, delta_x, delta_y, max_delta_x, max_delta_y, all_max_deltas_x
+
+@segment_cache(segment_cache_size, segment_cache_bytes)
+@profiling.timed("scans")
+def line_chunk(x1,y1,x2,y2,z_thickness,z_spacing,kerf_angle,xy_spacing,first,chunk):
+	"""
+	Returns layers first to first + chunk of a line() cut, read-only as it
+	is cached.
+	"""
+	layers, taper_x, taper_y, delta_x, delta_y, max_delta_x, max_delta_y, all_max_deltas_x = line_geometry(x1,y1,x2,y2,z_thickness,z_spacing,kerf_angle,xy_spacing)
+	step = Cutlist.command("z_step", -z_spacing, fmt_of(z_spacing))
+	a = np.arange(first, min(first + chunk, layers))
+	max_deltas_x = all_max_deltas_x[a]
+
+	def layout(n):
+		new_x1 = scan_offsets(x1 + a*taper_x, delta_x, len(a), n)
+		new_y1 = scan_offsets(y1 + a*taper_y, delta_y, len(a), n)
+		inside = (np.abs(new_x1 - x1) < np.abs(max_deltas_x)[:,None]) | (np.abs(new_y1 - y1) < abs(max_delta_y))
+		return inside, (new_x1, new_y1)
+
+	n = int(max(abs(max_delta_x/delta_x) if delta_x else 0, abs(max_delta_y/delta_y) if delta_y else 0)) + 2
+	counts, (new_x1, new_y1) = raster(n, layout)
+	n = new_x1.shape[1]
+	new_x2 = scan_offsets(x2 + a*taper_x, delta_x, len(a), n)
+	new_y2 = scan_offsets(y2 + a*taper_y, delta_y, len(a), n)
+
+	x, y = serpentine(counts, new_x1, new_y1, new_x2, new_y2)
+	return Cutlist.layered(counts, [JUMP, MARK], x, y, FIXED, step, where="before").frozen()
+
+def z_focus(block,cut,laser):
+	"""
+	This algorithm returns a cutlist which describes a series of parallel lines,
+	each with a different z value, to calibrate the z value for the laser.
+	"""
+	return Cutlist.concat(triggered(z_focus_segments(block,cut,laser)))
+
+def z_focus_segments(block,cut,laser):
+	iterations = int(cut["final_dimension_z"]/laser["z_spacing"])
+	#Currently x,y is decided to take up a good amount of the block, rather than having set distances and sizes
+	y = cut["final_dimension_y"]/2
+	x = scan_offsets(0.0, laser["xy_spacing"], 1, iterations)[0]
+
+	step = Cutlist.command("z_rel", -laser["z_spacing"], fmt_of(laser["z_spacing"]))
+	lines = Cutlist.layered(np.ones(iterations), [JUMP, MARK], np.stack((x, x), axis=1),
+							np.tile([y, -y], (iterations, 1)), FIXED, step)
+	yield Cutlist.command("z_abs", 0, INT)
+	yield lines
+
+
+def simple_core(block,cut,laser,spiral=False):
+	"""
+	This algorithm returns a cutlist which performs a simple core operation.
+	The laser runs race track style around the specified core, going around
+	all 4 sides before the laser moves down to the next layer. The poly is
+	expected to fall off the core at the end of the entire cutting operation.
+
+	With spiral=True the race tracks of a layer are merged into a single
+	spiral: instead of jumping to the corner of the next race track, the
+	laser marks across to it. The rings are xy_spacing apart, so the short
+	diagonal only crosses material the layer removes anyway, and each layer
+	needs one jump rather than one per race track.
+	"""
+	return Cutlist.concat(simple_core_segments(block,cut,laser,spiral))
+
+def simple_core_segments(block,cut,laser,spiral=False):
+	layers = int(block["thickness"]/laser["z_spacing"])
+
+	#Since all cuts are square, the offsets are more obvious than in the general linear case.
+	taper = math.tan(math.radians(laser["kerf_angle"]/2)) * laser["z_spacing"]
+	max_delta = math.tan(math.radians(laser["kerf_angle"]/2)) * (block["thickness"] + laser["z_final_overshoot"]) * 2
+	all_max_deltas = np.cumsum(np.concatenate(([max_delta], np.full(max(layers - 1, 0), -taper))))[:layers]
+	step = Cutlist.command("z_step", -laser["z_spacing"], fmt_of(laser["z_spacing"]))
+
+	yield Cutlist.command("a_abs", 0, INT)
+	yield Cutlist.command("c_abs", block["physical_rotation"], fmt_of(block["physical_rotation"]))
+	yield Cutlist.command("z_abs", block["thickness"], fmt_of(block["thickness"]))
+
+	for first in range(0, layers, layer_chunk):
+		a = np.arange(first, min(first + layer_chunk, layers))
+		max_deltas = all_max_deltas[a]
+
+		def layout(n):
+			x1 = scan_offsets(cut["final_dimension_x"]/2 + a*taper, laser["xy_spacing"], len(a), n)
+			return np.abs(x1 - cut["final_dimension_x"]/2) < np.abs(max_deltas)[:,None], x1
+		counts, x1 = raster(int(abs(max_delta)/laser["xy_spacing"]) + 2, layout)
+		y1 = scan_offsets(cut["final_dimension_y"]/2 + a*taper, laser["xy_spacing"], len(a), x1.shape[1])
+
+		#Each race track starts and finishes at its (+x,+y) corner
+		valid = np.arange(x1.shape[1]) < counts[:,None]
+		x1, y1 = x1[valid], y1[valid]
+		x = np.stack((x1, x1, -x1, -x1, x1), axis=1) + block["origin_x"]
+		y = np.stack((y1, -y1, -y1, y1, y1), axis=1) + block["origin_y"]
+		rings = Cutlist.layered(counts, [JUMP, MARK, MARK, MARK, MARK], x, y, FLOAT, step)
+		if spiral:
+			#Every race track after the first in a layer is reached by marking across from the last
+			jumps = np.flatnonzero(rings.op == JUMP)
+			layer = np.cumsum(rings.op == Z_STEP)[jumps]
+			rings.op[jumps[1:][layer[1:] == layer[:-1]]] = MARK
+		yield rings
+
+def vertical_core(block,cut,laser,workers=None,processes=False):
+	"""
+	This algorithm returns a cutlist which performs a vertical core operation.
+	The laser cuts off one side of poly at a time, rotating the block such that
+	the edge of the laser "cone" is parallel to the SCD core. After one side of
+	the block has been removed, the block is rotated 90 degrees and the algorithm
+	repeats until all 4 sides have been removed.
+	"""
+	return Cutlist.concat(triggered(vertical_core_segments(block,cut,laser,workers,processes)))
+
+@lru_cache(maxsize=geometry_cache_size, typed=True)
+@profiling.timed("geometry")
+def vertical_geometry(thickness, origin_x, origin_y, final_dimension_x, final_dimension_y, kerf_angle, z_final_overshoot):
+	"""
+	This function works out the kerf angle, the z of each side, where the
+	scans of the wide and long sides start and how deep each side is cut
+	for vertical_core().
+	"""
+	angle = math.radians(kerf_angle/2)
+
+	u = math.tan(2 * angle) * (thickness + z_final_overshoot)
+	z_0 = thickness*math.cos(angle) + math.sin(angle)*((final_dimension_y)/2 - origin_y + u)
+	z_1 = thickness*math.cos(angle) + math.sin(angle)*((final_dimension_x)/2 + origin_x + u)
+	z_2 = thickness*math.cos(angle) + math.sin(angle)*((final_dimension_y)/2 + origin_y + u)
+	z_3 = thickness*math.cos(angle) + math.sin(angle)*((final_dimension_x)/2 - origin_x + u)
+
+	y_start_wide = ((u + final_dimension_x/2)* math.cos(angle) 
+				 - thickness*math.sin(angle) 
+				 - u/math.cos(angle))
+	y_start_length = ((u + final_dimension_y/2)* math.cos(angle) 
+				   - thickness*math.sin(angle) 
+				   - u/math.cos(angle))
+
+	depth_cut = (thickness + z_final_overshoot) * math.cos(angle)/math.cos(2*angle)
+	return angle, z_0, z_1, z_2, z_3, y_start_wide, y_start_length, depth_cut
+
+def vertical_core_segments(block,cut,laser,workers=None,processes=False):
+	"""
+	Yields the cutlist of vertical_core(). Each side keeps the trigger pair
+	line() gives it, so the trigger is stopped while the block rotates.
+	With workers, the four sides are built at once by parallel(), each as a
+	single segment, instead of layer_chunk layers at a time.
+	"""
+	angle, z_0, z_1, z_2, z_3, y_start_wide, y_start_length, depth_cut = vertical_geometry(
+		block["thickness"], block["origin_x"], block["origin_y"], cut["final_dimension_x"], cut["final_dimension_y"],
+		laser["kerf_angle"], laser["z_final_overshoot"])
+
+	yield Cutlist.command("a_abs", math.degrees(angle))
+	yield Cutlist.command("c_abs", block["physical_rotation"], fmt_of(block["physical_rotation"]))
+	yield Cutlist.command("z_abs", z_0)
+
+	sides = [(block["width"]/2 - block["origin_x"],y_start_length - block["origin_y"],-block["width"]/2 - block["origin_x"],y_start_length - block["origin_y"],depth_cut,laser),
+			 (block["length"]/2 + block["origin_y"],y_start_wide - block["origin_x"],-block["length"]/2 + block["origin_y"],y_start_wide - block["origin_x"],depth_cut,laser),
+			 (block["width"]/2 + block["origin_x"],y_start_length + block["origin_y"],-block["width"]/2 + block["origin_x"],y_start_length + block["origin_y"],depth_cut,laser),
+			 (block["length"]/2 - block["origin_y"],y_start_wide + block["origin_x"],-block["length"]/2 - block["origin_y"],y_start_wide + block["origin_x"],depth_cut,laser)]
+
+	if workers:
+		cut1, cut2, cut3, cut4 = [[side] for side in parallel([(line, args) for args in sides], workers, processes)]
+	else:
+		cut1, cut2, cut3, cut4 = [triggered(line_segments(*args)) for args in sides]
+
+	#cut1 = json.loads(line(block["width"]/2,y_start_length,-block["width"]/2,y_start_length,depth_cut,laser))
+
+	#cut2 = json.loads(line(block["length"]/2,y_start_wide,-cut["final_dimension_y"]/2,y_start_wide,depth_cut,laser))
+
+	#cut3 = json.loads(line(block["width"]/2,y_start_length,-cut["final_dimension_x"]/2,y_start_length,depth_cut,laser))
+
+	#cut4 = json.loads(line(cut["final_dimension_y"]/2,y_start_wide,-cut["final_dimension_y"]/2,y_start_wide,depth_cut,laser))
+
+	yield from cut1
+	yield Cutlist.command("c_rel", 90, INT)
+	yield Cutlist.command("z_abs", z_1)
+	yield from cut2
+	yield Cutlist.command("c_rel", 90, INT)
+	yield Cutlist.command("z_abs", z_2)
+	yield from cut3
+	yield Cutlist.command("z_abs", z_3)
+	yield Cutlist.command("c_rel", 90, INT)
+	yield from cut4
+
+
+@segment_cache(segment_cache_size, segment_cache_bytes)
+@profiling.timed("scans")
+def pyramid_slice(x1,y1,x2,y2,z,delta,deltaz,taper_x,taper_y,taper_straight,layers):
+	"""
+	This algorithm returns a cutlist which performs a cut which is a quarter
+	of the total slicing required to create a pyramid top, while ensuring a flat
+	bottom above it, both of which is required for an OG seed. The cutlist is
+	cached, so it is read-only.
+	"""
+	a = np.arange(layers)
+	new_x1, new_x2 = x1 - a*taper_x, x2 + a*taper_x
+	starts = y1 - a*taper_straight
+	#y_max shrinks by taper_straight then taper_y every layer
+	y_maxs = np.cumsum(np.concatenate(([abs(y1-y2)], np.tile([-taper_straight, -taper_y], max(layers - 1, 0)))))[::2][:layers]
+
+	def layout(n):
+		new_y1 = scan_offsets(starts, -delta, layers, n)
+		return (np.abs(new_y1 - starts[:,None]) < y_maxs[:,None]) & (x1 > 0), new_y1
+	counts, new_y1 = raster(int(abs(y1-y2)/delta) + 2, layout)
+
+	x, y = serpentine(counts, new_x1[:,None], new_y1, new_x2[:,None], new_y1)
+	step = Cutlist.command("z_step", -deltaz, fmt_of(deltaz))
+	return Cutlist.layered(counts, [JUMP, MARK], x, y, FIXED, step, where="between").frozen()
+
+# def oss_stacked(block, cut, laser):
+# 	"""
+# 	This algorithm returns a cutlist which performs OG slicing. It begins
+# 	with an optional core, then cuts out slices until as many OG seeds as 
+# 	specified are removed from the block.
+# 	"""
+# 	pyramid_angle_1 = math.atan(cut["pyramid_height"]/(cut["final_dimension_x"]/2))
+# 	pyramid_angle_2 = math.atan(cut["pyramid_height"]/(cut["final_dimension_y"]/2))
+
+# 	angle = math.radians(laser["kerf_angle"]/2)
+# 	gap = math.tan(pyramid_angle_1) * (cut["final_dimension_x"]/2) + cut["gap_size"]
+# 	unit_length = gap + cut["base_height"]
+# 	max_slices = math.floor(block["thickness"]/unit_length)
+
+# 	if cut["core"] == "yes":
+# 		cutlist = json.loads(vertical_core(block,cut,laser))
+# 		return json.dumps(cutlist)
+# 	else:
+# 		cutlist = []
+
+# 	a0 = -(90 + math.degrees(angle))
+
+# 	if cut["excess"] == "top":
+# 		#Cut out of bottom_up
+# 		side_x = unit_length * max_slices-cut["pyramid_height"]
+# 	elif cut["excess"] == "bottom":
+# 		#Cut out of top
+# 		side_x = block["thickness"]-cut["pyramid_height"]
+
+# 	diagonal_1 = math.sqrt(side_x**2 + (cut["final_dimension_x"]/2)**2)
+# 	theta_1 = math.atan(side_x*2/cut["final_dimension_x"])
+# 	z0_1 = math.cos(theta_1 + angle) * diagonal_1
+
+# 	diagonal_2 = math.sqrt(side_x**2 + (cut["final_dimension_y"]/2)**2)
+# 	theta_2 = math.atan(side_x*2/cut["final_dimension_y"])
+# 	z0_2 = math.cos(theta_2 + angle) * diagonal_2
+
+
+# 	x1_1 = math.sin(theta_1 + angle) * diagonal_1
+# 	x1_2 = math.sin(theta_2 + angle) * diagonal_2
+# 	x_offset = gap/math.cos(angle)
+# 	x0_1 = x1_1 + x_offset
+# 	x0_2 = x1_2 + x_offset
+
+# 	z_shift = (cut["base_height"] + gap) * math.sin(angle)
+# 	x_shift = (cut["base_height"] + gap) * math.cos(angle)
+
+# 	cutlist.append(["a_abs",f"{a0:.6f}"])
+# 	cutlist.append(["c_abs",str(block["physical_rotation"])])
+# 	cutlist.append(["z_abs",f"{z0_1:.6f}"])
+
+# 	if pyramid_angle_1 >= angle and pyramid_angle_2 >= angle:
+# 		max_depth_1 = ((cut["pyramid_height"]/math.sin(pyramid_angle_1))*math.cos(angle))*refraction
+# 		max_layers_1 = math.ceil(max_depth_1/laser["z_spacing"])
+# 		max_depth_2 = ((cut["pyramid_height"]/math.sin(pyramid_angle_2))*math.cos(angle))*refraction
+# 		max_layers_2 = math.ceil(max_depth_2/laser["z_spacing"])
+
+# 		if cut["layers"] == "max":
+# 			layers_1 = max_layers_1 + 1
+# 			layers_2 = max_layers_2 + 1
+# 		else:
+# 			layers_1 = cut["layers"]
+# 			layers_2 = cut["layers"]
+
+# 		new_angle_1 = math.atan((math.tan(pyramid_angle_1))/refraction)
+# 		taper_y_1 = math.tan(new_angle_1 - angle)*(laser["z_spacing"])
+# 		taper_x_1 = cut["final_dimension_x"]/(2*max_layers_1)
+# 		new_angle_2 = math.atan((math.tan(pyramid_angle_2))/refraction)
+# 		taper_y_2 = math.tan(new_angle_2 - angle)*(laser["z_spacing"])
+# 		taper_x_2 = cut["final_dimension_x"]/(2*max_layers_2)
+# 		taper_straight = math.tan(angle)*(laser["z_spacing"])
+
+# 		if cut["num_of_seeds"] == "max":
+# 			num_slices = max_slices
+# 		else:
+# 			num_slices = cut["num_of_seeds"] + 1
+
+# 		for i in range(num_slices):
+# 			cutlist = (cutlist
+# 						  + pyramid_slice(cut["final_dimension_y"]/2,x0_1,-cut["final_dimension_y"]/2,x1_1,z0_1,laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1)
+# 						  + [["z_abs",f"{z0_2:.6f}"]] + [["c_abs","90"]]
+# 						  + pyramid_slice(cut["final_dimension_x"]/2,x0_2,-cut["final_dimension_x"]/2,x1_2,z0_2,laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)
+# 						  + [["z_abs",f"{z0_1:.6f}"]] + [["c_abs","180"]]
+# 						  + pyramid_slice(cut["final_dimension_y"]/2,x0_1,-cut["final_dimension_y"]/2,x1_1,z0_1,laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1)
+# 						  + [["z_abs",f"{z0_2:.6f}"]] + [["c_abs","270"]]
+# 						  + pyramid_slice(cut["final_dimension_x"]/2,x0_2,-cut["final_dimension_x"]/2,x1_2,z0_2,laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)
+# 						  )
+# 			z0_1 = z0_1 + z_shift
+# 			z0_2 = z0_2 + z_shift
+# 			x0_1, x1_1, x0_2, x1_2 = x0_1 - x_shift, x1_1 - x_shift, x0_2 - x_shift, x1_2 - x_shift
+# 			cutlist.append(["c_abs",str(block["physical_rotation"])])
+# 			cutlist.append(["z_abs",f"{z0_1:.6f}"])	
+# 	else:
+# 		raise Exception("Pyramid angle too small")
+
+# 	return json.dumps(cutlist)
+
+def oss_helper(block, cut, laser, x):
+	return oss_geometry(block["thickness"], cut["pyramid_height"], cut["gap_size"], cut["base_height"], cut["excess"],
+						cut["layers"], cut["final_dimension_x"], laser["kerf_angle"], laser["z_spacing"], x)
+
+@lru_cache(maxsize=geometry_cache_size, typed=True)
+@profiling.timed("geometry")
+def oss_geometry(thickness, pyramid_height, gap_size, base_height, excess, layers, final_dimension_x, kerf_angle, z_spacing, x):
+	"""
+	This function works out the geometry of one pair of oss_stacked() sides
+	from the parameters it depends on, for oss_helper().
+	"""
+	pyramid_angle_1 = math.atan(pyramid_height/x)
+	angle = math.radians(kerf_angle/2)
+
+	gap = math.tan(pyramid_angle_1) * (x) + gap_size
+	unit_length = gap + base_height
+	max_slices = math.floor(thickness/unit_length)
+
+	if excess == "top":
+		#Cut out of bottom_up
+		side_x = unit_length * max_slices-pyramid_height
+	elif excess == "bottom":
+		#Cut out of top
+		side_x = thickness-pyramid_height
+
+	diagonal_1 = math.sqrt(side_x**2 + x**2)
+	theta_1 = math.atan(side_x/x)
+	z0_1 = math.cos(theta_1 + angle) * diagonal_1
+
+	x1_1 = math.sin(theta_1 + angle) * diagonal_1
+	x_offset = gap/math.cos(angle)
+	x0_1 = x1_1 + x_offset
+
+	max_depth_1 = ((pyramid_height/math.sin(pyramid_angle_1))*math.cos(angle))*refraction
+	max_layers_1 = math.ceil(max_depth_1/z_spacing)
+
+	if layers == "max":
+		layers_1 = max_layers_1 + 1
+	else:
+		layers_1 = layers
+
+	new_angle_1 = math.atan((math.tan(pyramid_angle_1))/refraction)
+	taper_y_1 = math.tan(new_angle_1 - angle)*(z_spacing)
+	taper_x_1 = final_dimension_x/(2*max_layers_1)
+
+	return x0_1, x1_1, z0_1, taper_x_1, taper_y_1, layers_1, pyramid_angle_1
+
+
+def oss_stacked(block, cut, laser, workers=None, processes=False, incremental=False):
+	"""
+	This algorithm returns a cutlist which performs OG slicing. It begins
+	with an optional core, then cuts out slices until as many OG seeds as 
+	specified are removed from the block.
+	"""
+	return Cutlist.concat(triggered(oss_stacked_segments(block, cut, laser, workers, processes, incremental)))
+
+def oss_stacked_segments(block, cut, laser, workers=None, processes=False, incremental=False):
+	"""
+	Yields the cutlist of oss_stacked(), one slice at a time. The slices
+	are planned first and built by parallel(), so with workers several
+	slices, of the same or later seeds, are built at once.
+
+	With incremental, the seeds built are kept by oss_seeds() and yielded
+	one segment per seed, so asking again for the same cut with more seeds
+	only builds the seeds that were not built before.
+	"""
+	if incremental:
+		seeds = oss_seeds(json.dumps([block, {k: v for k, v in cut.items() if k != "num_of_seeds"}, laser], sort_keys=True))
+	else:
+		seeds = OssSeeds(block, cut, laser)
+
+	if cut["core"] == "yes":
+		yield from vertical_core_segments(block,cut,laser,workers,processes)
+
+	yield Cutlist.command("a_abs", seeds.a0)
+	yield Cutlist.command("c_abs", block["physical_rotation"], fmt_of(block["physical_rotation"]))
+	yield Cutlist.command("z_abs", seeds.start_z, FLOAT)
+
+	if seeds.pyramid_angle_1 >= seeds.angle and seeds.pyramid_angle_2 >= seeds.angle:
+
+		if cut["num_of_seeds"] == "max":
+			num_slices = seeds.max_slices
+		else:
+			num_slices = cut["num_of_seeds"] + 1
+
+		if incremental:
+			yield from seeds.build(num_slices, workers, processes)
+			return
+
+		plan = [item for seed in seeds.plan(num_slices) for item in seed]
+		slices = parallel([(pyramid_slice, item) for item in plan if isinstance(item, tuple)], workers, processes)
+		for item in plan:
+			yield next(slices) if isinstance(item, tuple) else item
+	else:
+		raise Exception("Pyramid angle too small")
+
+class OssSeeds:
+	"""
+	Plans the seeds of an oss_stacked() cut in order. Each seed is shifted
+	by z_shift and x_shift from the one before, added on one seed at a time
+	as in the original loop, so planning can carry on from wherever it
+	stopped and later seeds come out exactly as if planned in one go.
+	Shifting a copy of the first seed instead would not, as every scan
+	position would be rounded differently.
+	"""
+
+	def __init__(self, block, cut, laser):
+		self.block, self.cut, self.laser = block, cut, laser
+		self.x0_1, self.x1_1, self.z0_1, self.taper_x_1, self.taper_y_1, self.layers_1, self.pyramid_angle_1 = oss_helper(block, cut, laser, cut["final_dimension_x"]/2)
+		self.x0_2, self.x1_2, self.z0_2, self.taper_x_2, self.taper_y_2, self.layers_2, self.pyramid_angle_2 = oss_helper(block, cut, laser, cut["final_dimension_y"]/2)
+		angle = math.radians(laser["kerf_angle"]/2)
+		gap = math.tan(self.pyramid_angle_1) * (cut["final_dimension_x"]/2) + cut["gap_size"]
+		unit_length = gap + cut["base_height"]
+		self.angle = angle
+		self.max_slices = math.floor(block["thickness"]/unit_length)
+		self.taper_straight = math.tan(angle)*(laser["z_spacing"])
+
+		self.a0 = -(90 + math.degrees(angle))
+
+		self.z_shift = (cut["base_height"] + gap) * math.sin(angle)
+		self.x_shift = (cut["base_height"] + gap) * math.cos(angle)
+
+		self.x_delta = math.sin(angle) * block["origin_x"]
+		self.y_delta = math.sin(angle) * block["origin_y"]
+		self.z1_delta = math.cos(angle) * block["origin_x"]
+		self.z2_delta = math.cos(angle) * block["origin_y"]
+		self.start_z = self.z0_1 + self.z2_delta
+
+		#Seeds built so far by build(), each as one read-only cutlist
+		self.seeds = []
+		self.lock = threading.Lock()
+
+	def plan(self, count):
+		"""
+		Plans the next count seeds and returns them as lists of commands, with
+		each slice given by its pyramid_slice() arguments.
+		"""
+		block, cut, laser = self.block, self.cut, self.laser
+		x0_1, x1_1, x0_2, x1_2, z0_1, z0_2 = self.x0_1, self.x1_1, self.x0_2, self.x1_2, self.z0_1, self.z0_2
+		taper_x_1, taper_y_1, layers_1, taper_x_2, taper_y_2, layers_2 = self.taper_x_1, self.taper_y_1, self.layers_1, self.taper_x_2, self.taper_y_2, self.layers_2
+		x_delta, y_delta, z1_delta, z2_delta, taper_straight = self.x_delta, self.y_delta, self.z1_delta, self.z2_delta, self.taper_straight
+		seeds = []
+		for i in range(count):
+			seeds.append([(cut["final_dimension_y"]/2 - block["origin_x"],x0_1 + y_delta,-cut["final_dimension_y"]/2 - block["origin_x"],x1_1 + y_delta,z0_1 + block["origin_y"],laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1),
+						  Cutlist.command("z_abs", z0_2 + z1_delta, FLOAT),
+						  Cutlist.command("c_abs", 90, INT),
+						  (cut["final_dimension_x"]/2 + block["origin_y"],x0_2 + x_delta,-cut["final_dimension_x"]/2 + block["origin_y"],x1_2 + x_delta,z0_2 + block["origin_x"],laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2),
+						  Cutlist.command("z_abs", z0_1 - z2_delta, FLOAT),
+						  Cutlist.command("c_abs", 180, INT),
+						  (cut["final_dimension_y"]/2 + block["origin_x"],x0_1 - y_delta,-cut["final_dimension_y"]/2 + block["origin_x"],x1_1 - y_delta,z0_1 - block["origin_y"],laser["xy_spacing"], laser["z_spacing"], taper_x_1,taper_y_1,taper_straight,layers_1),
+						  Cutlist.command("z_abs", z0_2 - z1_delta, FLOAT),
+						  Cutlist.command("c_abs", 270, INT),
+						  (cut["final_dimension_x"]/2 - block["origin_y"],x0_2 - x_delta,-cut["final_dimension_x"]/2 - block["origin_y"],x1_2 - x_delta,z0_2 - block["origin_x"],laser["xy_spacing"], laser["z_spacing"], taper_x_2,taper_y_2,taper_straight,layers_2)])
+			z0_1 = z0_1 + self.z_shift
+			z0_2 = z0_2 + self.z_shift
+			x0_1, x1_1, x0_2, x1_2 = x0_1 - self.x_shift, x1_1 - self.x_shift, x0_2 - self.x_shift, x1_2 - self.x_shift
+			seeds[-1].append(Cutlist.command("c_abs", block["physical_rotation"], fmt_of(block["physical_rotation"])))
+			seeds[-1].append(Cutlist.command("z_abs", z0_1 + z2_delta, FLOAT))
+		self.x0_1, self.x1_1, self.x0_2, self.x1_2, self.z0_1, self.z0_2 = x0_1, x1_1, x0_2, x1_2, z0_1, z0_2
+		return seeds
+
+	def build(self, count, workers=None, processes=False):
+		"""
+		Builds seeds until at least count have been built, with their slices
+		built by parallel(), and returns the first count.
+		"""
+		with self.lock:
+			plan = self.plan(max(count - len(self.seeds), 0))
+			slices = parallel([(pyramid_slice, item) for seed in plan for item in seed if isinstance(item, tuple)], workers, processes)
+			for seed in plan:
+				self.seeds.append(Cutlist.concat([next(slices) if isinstance(item, tuple) else item for item in seed]).frozen())
+			return self.seeds[:count]
+
+@lru_cache(maxsize=seed_cache_size)
+def oss_seeds(key):
+	"""
+	Returns the OssSeeds of the oss_stacked() cut given by key, the JSON of
+	its [block, cut, laser] without num_of_seeds, keeping the seeds built
+	for the seed_cache_size cuts used last.
+	"""
+	return OssSeeds(*json.loads(key))
+
+def cross(block, cut, laser):
+	return Cutlist.concat(cross_segments(block, cut, laser))
+
+def cross_segments(block, cut, laser):
+	for i in range(1,5):
+		yield Cutlist.points([JUMP, MARK], [0, 0], [i/4, -i/4], INT, FLOAT)
+		yield Cutlist.points([JUMP, MARK], [i/4, -i/4], [0, 0], FLOAT, INT)
+		if i < 4:
+			yield Cutlist.command("c_rel", 90, INT)
+
+def cache_info():
+	"""
+	Returns the hits, misses and size of each geometry and segment cache.
+	"""
+	return {function.__name__: function.cache_info()._asdict() for function in cached}
+
+def cache_clear():
+	"""
+	Empties every geometry and segment cache.
+	"""
+	for function in cached:
+		function.cache_clear()
+
+def time_taken(json_cutlist, laser):
+	"""
+	This algorithm takes a cutlist and returns an estimate for the time
+	taken to execute this algorithm in hours:minutes:seconds, based on jump
+	and mark speeds as well as experimental data on how long a,c,z
+	transformations take. The cutlist may be JSON or a Cutlist, including
+	one opened with cutlist.load_binary().
+	"""
+	return str(timedelta(seconds=int(time_breakdown(json_cutlist, laser)["total"]/1000)))
+
+def time_breakdown(cutlist, laser):
+	"""
+	This function estimates how long a cutlist takes to run, in ms. Jumps
+	and marks take their length over jump_speed or mark_speed (mm/s), each
+	a/c/z command takes the time given by axis_times for the distance that
+	axis moves, and every set_trigger4/stop_trigger adds the trigger time.
+
+	Returns a dictionary with the total, the time per kind of command, and
+	arrays of the time spent in each layer (started by every z command) and
+	in each phase (started by every a or c command).
+	"""
+	cutlist = as_cutlist(cutlist)
+	times = dict(axis_times, **laser.get("axis_times", {}))
+	op = cutlist.op
+	ms = np.zeros(len(cutlist))
+
+	#Jumps and marks travel from wherever the galvo was before them
+	x, y = xy_positions(cutlist)
+	length = np.hypot(np.diff(x, prepend=0.0), np.diff(y, prepend=0.0))
+	ms[op == JUMP] = length[op == JUMP] / laser["jump_speed"] * 1000
+	ms[op == MARK] = length[op == MARK] / laser["mark_speed"] * 1000
+
+	breakdown = {"jump": float(ms[op == JUMP].sum()), "mark": float(ms[op == MARK].sum())}
+	for axis, (absolute, relative) in AXES.items():
+		moves = np.isin(op, (absolute,) + relative)
+		travel = np.abs(np.diff(axis_positions(cutlist, axis), prepend=0.0))
+		ms[moves] = times[axis]["settle"] + travel[moves] * times[axis]["per_unit"]
+		breakdown[axis] = float(ms[moves].sum())
+	triggers = (op == SET_TRIGGER4) | (op == STOP_TRIGGER)
+	ms[triggers] = times["trigger"]
+	breakdown["trigger"] = float(ms[triggers].sum())
+
+	breakdown["total"] = float(ms.sum())
+	layer = np.cumsum(np.isin(op, (Z_ABS, Z_REL, Z_STEP)))
+	phase = np.cumsum(np.isin(op, (A_ABS, A_REL, A_STEP, C_ABS, C_REL, C_STEP)))
+	breakdown["layers"] = np.bincount(layer, weights=ms)
+	breakdown["phases"] = np.bincount(phase, weights=ms)
+	return breakdown
+
+cached = [line_geometry, line_chunk, vertical_geometry, pyramid_slice, oss_geometry, oss_seeds]
+
+def cut_segments(block, cut, laser, workers=None, processes=False, incremental=False):
+	"""
+	This function returns the segments of the cutlist for the cut named by
+	cut["cut_process"], trigger included, without building the cutlist.
+	workers and processes are passed to the cuts made of independent parts
+	(vertical_core and oss_stacked), see parallel(), and incremental to
+	oss_stacked.
+	"""
+	if cut["cut_process"] == "line":
+		return triggered(line_segments(cut["x1"],cut["y1"],cut["x2"],cut["y2"],cut["final_dimension_z"]+laser["z_final_overshoot"],laser))
+	elif cut["cut_process"] == "simple_core":
+		return simple_core_segments(block,cut,laser,cut.get("spiral") == "yes")
+	elif cut["cut_process"] == "vertical_core":
+		return triggered(vertical_core_segments(block,cut,laser,workers,processes))
+	elif cut["cut_process"] == "oss_stacked":
+		return triggered(oss_stacked_segments(block,cut,laser,workers,processes,incremental))
+	elif cut["cut_process"] == "z_focus":
+		return triggered(z_focus_segments(block,cut,laser))
+	elif cut["cut_process"] == "cross":
+		return cross_segments(block,cut,laser)
+	else:
+		raise Exception("No such cut exists: Check cut_process")
+
+def generating(segments):
+	"""
+	Yields segments, timing how long each one takes to generate in the
+	active trace. It wraps the generators themselves, so that the stages
+	applied to their segments afterwards are timed on their own.
+	"""
+	segments = iter(segments)
+	while True:
+		with profiling.stage("generate"):
+			segment = next(segments, None)
+		if segment is None:
+			return
+		yield segment
+
+def profiled(segments):
+	"""
+	Yields segments, counting the commands of each type in them, their
+	layers (z moves) and their scans (jumps) in the active trace.
+	"""
+	for segment in segments:
+		kinds = np.bincount(segment.op, minlength=len(OPCODES))
+		for name, n in zip(OPCODES, kinds.tolist()):
+			if n:
+				profiling.count(name, n)
+		profiling.count("commands", len(segment))
+		profiling.count("layers", int(kinds[Z_ABS] + kinds[Z_REL] + kinds[Z_STEP]))
+		profiling.count("scans", int(kinds[JUMP]))
+		yield segment
+
+def generateCutList(cut_configuration, stream=False, json_path=None, compress=False, binary_path=None,
+					shorten_jumps=False, compact=False, workers=None, processes=False, output_path=None,
+					incremental=False, trace_path=None, check_envelope=True, report=None):
+	"""
+	This function takes a cut_configuration json object and calls the function
+	corresponding to the desired cut, thereby returning the cutlist.
+
+	With stream=True the whole cutlist is never held in memory. Each segment
+	is written to the CSV file, and to json_path if given, as soon as it is
+	generated, and the path of the CSV file is returned instead. compress
+	gzips the CSV file as it is written. binary_path also writes the cutlist
+	in the binary format read by cutlist.load_binary().
+
+	shorten_jumps reorders the scans within each layer and side to reduce
+	jump travel (see optimise.optimise_jumps), and the jump distances and
+	time saved are added to report["jumps"] if report, a dictionary, is
+	given. compact removes redundant jumps and a/c/z moves (see
+	optimise.peephole), and how many of each were removed is added to
+	report["removed"].
+
+	workers builds the sides of a vertical_core and the slices of an
+	oss_stacked that many at a time, on threads, or on processes if
+	processes is set. The cutlist is the same either way.
+
+	The CSV file is written to output_path if given, otherwise it is named
+	after the current time in save_path.
+
+	incremental keeps the seeds of an oss_stacked cut, so that generating it
+	again with only num_of_seeds changed just builds the extra seeds (see
+	OssSeeds).
+
+	trace_path records where the time goes, in each stage from parsing the
+	configuration to writing the files, along with counts of the commands
+	of each type, layers and scans, and saves it there as a Chrome trace
+	(see profiling.Trace).
+
+	Every command is checked against the machine envelope as it is
+	generated, and an Exception is raised at the first command outside it.
+	The machine's limits come from laser["envelope"]; without them only
+	what holds on any machine is checked, known commands with finite values
+	and no z_abs below 0 (see validate.envelope). check_envelope=False skips
+	the check.
+	"""
+	with profiling.recording(trace_path) if trace_path is not None else nullcontext():
+		#Check that this line reads json.loads(cut_configuration)
+		with profiling.stage("parse config"):
+			input_json = json.load(cut_configuration)
+
+		#Currently only desired_cut and laser_cut_config are required
+		try:
+			block = input_json["block"]
+		except:
+			block = None
+		try:
+			cut = input_json["desired_cut"]
+			laser = input_json["laser_cut_config"]
+		except:
+			raise Exception("Either desired_cut or laser_cut_config not provided")
+
+		segments = cut_segments(block, cut, laser, workers, processes, incremental)
+		if profiling.active() is not None:
+			segments = generating(segments)
+		report = {} if report is None else report
+		if shorten_jumps:
+			segments = optimise_segments(segments, laser, report.setdefault("jumps", {}))
+		if compact:
+			segments = peephole_segments(segments, report.setdefault("removed", {}))
+		if check_envelope:
+			segments = validated(segments, laser.get("envelope"))
+		if profiling.active() is not None:
+			segments = profiled(segments)
+		now = datetime.now()
+		timestamp = str(now.strftime("%m-%d_%H_%M"))
+		complete_name = os.path.join(save_path, timestamp+".csv")
+		if output_path is not None:
+			complete_name = output_path
+		elif compress:
+			complete_name = complete_name + ".gz"
+
+		if stream:
+			with CutlistWriter(complete_name, json_path, compress, binary_path=binary_path, laser=laser) as writer:
+				for segment in segments:
+					writer.write(segment)
+			return complete_name
+
+		with profiling.stage("concat"):
+			final_list = Cutlist.concat(segments)
+		with CutlistWriter(complete_name, json_path, compress, binary_path=binary_path, laser=laser) as writer:
+			writer.write(final_list)
+		with profiling.stage("to_json"):
+			return final_list.to_json()
+
+def main(argv=None):
+	#USED FOR TESTING. Read data from file given as argument
+	argv = sys.argv[1:] if argv is None else argv
+	input_file = argv[0]
+
+	#Also used for testing. The JSON is written to test.txt as it is generated
+	with open(input_file, encoding="utf8") as f:
+		generateCutList(f, stream=True, json_path="test.txt")
+
+if __name__ == "__main__":
+	main()
+
+
 	
\ No newline at end of file
@@ -0,0 +1,309 @@
+#!/usr/bin/python
+import numpy as np
+from cutlist import Cutlist, as_cutlist, axis_positions, xy_positions, AXES, FLOAT, INT, JUMP, MARK, SET_TRIGGER4, STOP_TRIGGER
+from profiling import stage
+
+def previous(values, first):
+	"""
+	Returns values shifted along by one command, starting with first.
+	"""
+	return np.concatenate(([first], values))[:len(values)]
+
+def jump_length(cutlist, start=(0.0, 0.0)):
+	"""
+	This function returns the total distance travelled by jumps, in mm, with
+	the galvo starting at start.
+	"""
+	x, y = xy_positions(cutlist, start)
+	length = np.hypot(np.diff(x, prepend=start[0]), np.diff(y, prepend=start[1]))
+	return float(length[cutlist.op == JUMP].sum())
+
+def nearest_neighbour(start_x, start_y, end_x, end_y, x, y, anchored):
+	"""
+	This function orders a block's polylines greedily, always jumping to the
+	nearest end of a polyline not yet cut, starting from (x,y). A polyline
+	entered at its end is cut backwards. An anchored first polyline has no
+	jump of its own, so it stays first and forwards. Returns the order, which
+	polylines are reversed and the total jump distance.
+	"""
+	n = len(start_x)
+	done = np.zeros(n, dtype=bool)
+	order, reverse = [], []
+	total = 0.0
+	if anchored:
+		done[0] = True
+		order.append(0)
+		reverse.append(False)
+		x, y = end_x[0], end_y[0]
+	for _ in range(n - len(order)):
+		forward = np.hypot(start_x - x, start_y - y)
+		backward = np.hypot(end_x - x, end_y - y)
+		forward[done] = np.inf
+		backward[done] = np.inf
+		i = int(np.argmin(np.minimum(forward, backward)))
+		backwards = bool(backward[i] < forward[i])
+		total = total + (backward[i] if backwards else forward[i])
+		done[i] = True
+		order.append(i)
+		reverse.append(backwards)
+		x, y = (start_x[i], start_y[i]) if backwards else (end_x[i], end_y[i])
+	return order, reverse, total
+
+def optimise_jumps(cutlist, laser=None, start=(0.0, 0.0)):
+	"""
+	This function reorders and reverses the polylines (a jump followed by
+	its marks) within each block of consecutive jumps and marks, to shorten
+	the jumps between them. Blocks end at every other command, so polylines
+	never move across a layer, a rotation or a trigger. A block is only
+	changed if the new order is shorter. The galvo starts at start, where
+	the commands before the cutlist left it. A block followed by a mark,
+	with no jump before it, keeps its last polyline last and forwards, as
+	that mark is cut from where the block ends.
+
+	Returns the new cutlist and a report of the jump distance before and
+	after, in mm, and of the time saved in ms at laser["jump_speed"].
+	"""
+	cutlist = as_cutlist(cutlist)
+	op = cutlist.op
+	is_point = (op == JUMP) | (op == MARK)
+	after_point = previous(is_point, False)
+	starts = np.flatnonzero(is_point & ((op == JUMP) | ~after_point))
+	#A polyline ends at the next one, or at the first command after it that is not a point
+	not_point = np.append(np.flatnonzero(~is_point), len(op))
+	ends = np.minimum(np.append(starts[1:], len(op)), not_point[np.searchsorted(not_point, starts)])
+	block = np.cumsum(~is_point)[starts]
+
+	index = np.arange(len(op))
+	new_op = op.copy()
+	#Blocks start where the one before, as reordered, left the galvo
+	position = start
+	groups = np.split(np.arange(len(starts)), np.flatnonzero(np.diff(block)) + 1) if len(starts) else []
+	for number, group in enumerate(groups):
+		s, e = starts[group], ends[group]
+		x0, y0 = position
+		position = (cutlist.x[e[-1] - 1], cutlist.y[e[-1] - 1])
+		if len(group) < 2:
+			continue
+		anchored = op[s[0]] == MARK
+		tied = number + 1 < len(groups) and op[starts[groups[number + 1][0]]] == MARK
+		free = len(group) - 1 if tied else len(group)
+		order, reverse, total = nearest_neighbour(cutlist.x[s[:free]], cutlist.y[s[:free]], cutlist.x[e[:free] - 1], cutlist.y[e[:free] - 1],
+												  x0, y0, anchored)
+		if tied:
+			i = order[-1]
+			end_x, end_y = (cutlist.x[s[i]], cutlist.y[s[i]]) if reverse[-1] else (cutlist.x[e[i] - 1], cutlist.y[e[i] - 1])
+			total = total + np.hypot(cutlist.x[s[-1]] - end_x, cutlist.y[s[-1]] - end_y)
+			order, reverse = order + [len(group) - 1], reverse + [False]
+
+		jumps = op[s] == JUMP
+		current = np.hypot(cutlist.x[s] - np.concatenate(([x0], cutlist.x[e - 1][:-1])),
+						   cutlist.y[s] - np.concatenate(([y0], cutlist.y[e - 1][:-1])))[jumps].sum()
+		if total >= current:
+			continue
+
+		last = order[-1]
+		position = (cutlist.x[s[last]], cutlist.y[s[last]]) if reverse[-1] else (cutlist.x[e[last] - 1], cutlist.y[e[last] - 1])
+		records = [np.arange(s[i], e[i])[::-1] if backwards else np.arange(s[i], e[i]) for i, backwards in zip(order, reverse)]
+		index[s[0]:e[-1]] = np.concatenate(records)
+		lengths = np.cumsum([0] + [len(r) for r in records])
+		new_op[s[0]:e[-1]] = MARK
+		new_op[s[0] + lengths[:-1]] = JUMP
+		if anchored:
+			new_op[s[0]] = MARK
+
+	optimised = Cutlist(new_op, cutlist.x[index], cutlist.y[index], cutlist.value[index], cutlist.fmt[index])
+	report = {"jump_before": jump_length(cutlist, start), "jump_after": jump_length(optimised, start)}
+	if laser is not None:
+		report["saved_ms"] = (report["jump_before"] - report["jump_after"]) / laser["jump_speed"] * 1000
+	return optimised, report
+
+def end_position(cutlist, start):
+	"""
+	Returns where the galvo is after a cutlist, which started at start.
+	"""
+	points = np.flatnonzero((cutlist.op == JUMP) | (cutlist.op == MARK))
+	return (float(cutlist.x[points[-1]]), float(cutlist.y[points[-1]])) if len(points) else start
+
+def optimise_segments(segments, laser, report):
+	"""
+	Applies optimise_jumps() to the segments as they are generated, adding
+	the distances and time saved to report. Each segment starts where the
+	one before left the galvo, as optimised, and the jumps before are
+	measured along the segments as generated. How the last block of jumps
+	and marks generated can be reordered depends on whether a mark follows
+	it, so it is held back and optimised with the segments after it. The
+	result is the same as optimise_jumps() on the whole cutlist.
+	"""
+	for key in ("jump_before", "jump_after", "saved_ms"):
+		report.setdefault(key, 0.0)
+
+	def flush(cutlist, optimised):
+		before, after = jump_length(cutlist, original), jump_length(optimised, position)
+		report["jump_before"] = report["jump_before"] + before
+		report["jump_after"] = report["jump_after"] + after
+		report["saved_ms"] = report["saved_ms"] + (before - after) / laser["jump_speed"] * 1000
+		return end_position(optimised, position), end_position(cutlist, original)
+
+	pending = Cutlist()
+	position = original = (0.0, 0.0)
+	for segment in segments:
+		#Until another point is generated, nothing more can be optimised
+		if not np.isin(segment.op, (JUMP, MARK)).any():
+			pending = pending + segment
+			continue
+		pending = pending + segment
+		#The last block begins after the last command before its last point that is not a point
+		is_point = (pending.op == JUMP) | (pending.op == MARK)
+		held = np.flatnonzero(~is_point[:np.flatnonzero(is_point)[-1]])
+		if not len(held):
+			continue
+		held = held[-1] + 1
+		with stage("shorten jumps"):
+			#The first command of the last block says whether the block before is followed by a mark
+			optimised = optimise_jumps(pending[:held + 1], None, position)[0][:held]
+			position, original = flush(pending[:held], optimised)
+			pending = pending[held:]
+		yield optimised
+	if len(pending):
+		with stage("shorten jumps"):
+			optimised = optimise_jumps(pending, None, position)[0]
+			flush(pending, optimised)
+		yield optimised
+
+def machine_trace(cutlist):
+	"""
+	This function replays a cutlist and returns what the laser does: every
+	mark as (from x, from y, to x, to y, z, a, c), every trigger command with
+	the number of marks before it, and the final galvo and axis positions.
+	"""
+	op = cutlist.op
+	x, y = xy_positions(cutlist)
+	z, c, a = [axis_positions(cutlist, axis) for axis in ("z", "c", "a")]
+	from_x, from_y = previous(x, 0.0), previous(y, 0.0)
+	marks = op == MARK
+	triggers = (op == SET_TRIGGER4) | (op == STOP_TRIGGER)
+	trace = np.stack((from_x, from_y, x, y, z, a, c), axis=1)
+	final = trace[-1, 2:] if len(op) else np.zeros(5)
+	return trace[marks], np.stack((op[triggers], np.cumsum(marks)[triggers]), axis=1), final
+
+def motion_equivalent(before, after, tol=1e-9):
+	"""
+	This function checks that two cutlists make the same marks, in the same
+	order and at the same z, a and c, with the same triggers between them,
+	and leave the machine in the same place.
+	"""
+	marks_1, triggers_1, final_1 = machine_trace(as_cutlist(before))
+	marks_2, triggers_2, final_2 = machine_trace(as_cutlist(after))
+	return (marks_1.shape == marks_2.shape and np.allclose(marks_1, marks_2, rtol=0, atol=tol)
+			and np.array_equal(triggers_1, triggers_2) and np.allclose(final_1, final_2, rtol=0, atol=tol))
+
+def peephole(cutlist, check=True):
+	"""
+	This function removes commands that do not change what the laser cuts:
+	jumps to where the galvo already is, jumps followed by another jump
+	before any mark or trigger, and a/c/z moves that are overridden or
+	cancelled before the next jump, mark or trigger. Each axis's moves in
+	such a run are fused into one, placed where its last move was.
+
+	Returns the new cutlist and the number of commands removed of each
+	kind. With check=True, the result is replayed against the original by
+	motion_equivalent() and an Exception is raised if they differ.
+	"""
+	cutlist = as_cutlist(cutlist)
+	op = cutlist.op
+	new_op, value, fmt = op.copy(), cutlist.value.copy(), cutlist.fmt.copy()
+	keep = np.ones(len(op), dtype=bool)
+	removed = {}
+
+	#Jumps to where the galvo already is
+	is_point = (op == JUMP) | (op == MARK)
+	x, y = xy_positions(cutlist)
+	moved = previous(np.maximum.accumulate(is_point), False)
+	still = (op == JUMP) & moved & (cutlist.x == previous(x, 0.0)) & (cutlist.y == previous(y, 0.0))
+	keep[still] = False
+
+	#Jumps that are followed by another jump before anything is marked or triggered
+	barriers = np.flatnonzero(keep & (is_point | (op == SET_TRIGGER4) | (op == STOP_TRIGGER)))
+	wasted = (op[barriers[:-1]] == JUMP) & (op[barriers[1:]] == JUMP)
+	keep[barriers[:-1][wasted]] = False
+	removed["jump"] = int(np.count_nonzero(op == JUMP) - np.count_nonzero(keep & (op == JUMP)))
+
+	#Runs of a/c/z moves with nothing else left between them
+	remaining = np.flatnonzero(keep)
+	is_move = np.isin(op[remaining], [code for absolute, relative in AXES.values() for code in (absolute,) + relative])
+	edges = np.flatnonzero(np.diff(np.concatenate(([0], is_move.astype(np.int8), [0]))))
+	for axis, (absolute, relative) in AXES.items():
+		removed[axis] = 0
+		axis_moves = np.isin(op, (absolute,) + relative)
+		for start, end in zip(edges[::2], edges[1::2]):
+			moves = remaining[start:end][axis_moves[remaining[start:end]]]
+			if len(moves) == 0 or (len(moves) == 1 and (op[moves[0]] == absolute or value[moves[0]] != 0)):
+				continue
+			absolutes = moves[op[moves] == absolute]
+			if len(absolutes):
+				tail = moves[moves > absolutes[-1]]
+				target = sum(value[tail].tolist(), value[absolutes[-1]])
+				code = absolute
+				source = np.append(absolutes[-1], tail)
+			else:
+				target = sum(value[moves].tolist())
+				code = op[moves[0]] if (op[moves] == op[moves[0]]).all() else relative[0]
+				source = moves
+				if target == 0:
+					keep[moves] = False
+					removed[axis] = removed[axis] + len(moves)
+					continue
+			keep[moves[:-1]] = False
+			removed[axis] = removed[axis] + len(moves) - 1
+			new_op[moves[-1]], value[moves[-1]] = code, target
+			if len(source) > 1:
+				fmt[moves[-1]] = INT if (fmt[source] == INT).all() and float(target).is_integer() else FLOAT
+			else:
+				fmt[moves[-1]] = fmt[source[0]]
+	removed["total"] = sum(removed.values())
+
+	optimised = Cutlist(new_op[keep], cutlist.x[keep], cutlist.y[keep], value[keep], fmt[keep])
+	if check and not motion_equivalent(cutlist, optimised):
+		raise Exception("Peephole optimisation changed the toolpath")
+	return optimised, removed
+
+def peephole_segments(segments, report):
+	"""
+	Applies peephole() to the segments as they are generated, adding the
+	number of commands removed to report. What peephole() removes can
+	depend on the commands after it, up to the next mark, so the commands
+	from a segment's last mark on are held back and optimised with the next
+	segment. The result is the same as peephole() on the whole cutlist.
+	"""
+	def removable(cutlist):
+		counts = {"jump": np.count_nonzero(cutlist.op == JUMP)}
+		for axis, (absolute, relative) in AXES.items():
+			counts[axis] = np.count_nonzero(np.isin(cutlist.op, (absolute,) + relative))
+		return counts
+
+	def flush(cutlist, optimised):
+		before, after = removable(cutlist), removable(optimised)
+		for key in before:
+			report[key] = report.get(key, 0) + int(before[key] - after[key])
+			report["total"] = report.get("total", 0) + int(before[key] - after[key])
+
+	pending = Cutlist()
+	for segment in segments:
+		with stage("peephole"):
+			pending = pending + segment
+			marks = np.flatnonzero(pending.op == MARK)
+			if not len(marks):
+				continue
+			optimised = peephole(pending)[0]
+			#Marks are never removed, so the last one is the last in both
+			held = marks[-1]
+			done = np.flatnonzero(optimised.op == MARK)[-1]
+			flush(pending[:held], optimised[:done])
+			optimised, pending = optimised[:done], pending[held:]
+		if len(optimised):
+			yield optimised
+	if len(pending):
+		with stage("peephole"):
+			optimised = peephole(pending)[0]
+			flush(pending, optimised)
+		yield optimised
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+class Trace:
+	"""
+	Records how long each stage of a job takes, and counts of what it
+	produced, as Chrome trace events. The saved file can be opened in
+	chrome://tracing or Perfetto to see where a slow job spent its time.
+	Stages may nest and may run on several threads.
+	"""
+
+	def __init__(self):
+		self.events = []
+		self.counters = {}
+		self.origin = time.perf_counter()
+		self.lock = threading.Lock()
+
+	def now(self):
+		"""
+		Returns the time since the trace began, in microseconds.
+		"""
+		return (time.perf_counter() - self.origin) * 1e6
+
+	@contextmanager
+	def stage(self, name, **args):
+		"""
+		Records the time taken by the with block as the stage name, with
+		args shown alongside it.
+		"""
+		start = self.now()
+		try:
+			yield
+		finally:
+			event = {"name": name, "cat": "stage", "ph": "X", "ts": start, "dur": self.now() - start,
+					 "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+			with self.lock:
+				self.events.append(event)
+
+	def count(self, name, amount=1):
+		"""
+		Adds amount to the counter name, and records the new value so that its
+		growth can be followed over the job.
+		"""
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + amount
+			self.events.append({"name": name, "cat": "counter", "ph": "C", "ts": self.now(),
+								"pid": os.getpid(), "args": {name: self.counters[name]}})
+
+	def summary(self):
+		"""
+		Returns the number of times each stage ran and its total time in ms,
+		which counts nested stages in both.
+		"""
+		stages = {}
+		for event in self.events:
+			if event["ph"] == "X":
+				total = stages.setdefault(event["name"], {"calls": 0, "ms": 0.0})
+				total["calls"] = total["calls"] + 1
+				total["ms"] = total["ms"] + event["dur"] / 1000
+		return stages
+
+	def save(self, path):
+		"""
+		Writes the trace to path as Chrome trace-event JSON, with the final
+		counters and the stage summary under otherData.
+		"""
+		counters = dict(self.counters)
+		if counters.get("layers"):
+			counters["scans per layer"] = counters.get("scans", 0) / counters["layers"]
+		with open(path, "w") as f:
+			json.dump({"traceEvents": self.events, "displayTimeUnit": "ms",
+					   "otherData": {"counters": counters, "stages": self.summary()}}, f)
+
+#The trace being recorded by recording() in this context, if any. Each thread starts
+#without one, so jobs run at once on different threads record into their own traces.
+current = contextvars.ContextVar("current", default=None)
+
+def active():
+	"""
+	Returns the trace being recorded in this context, or None.
+	"""
+	return current.get()
+
+@contextmanager
+def recording(path=None):
+	"""
+	Records a Trace of everything run in the with block, saving it to path
+	if given. Stages and counters are only recorded while a trace is active,
+	and cost next to nothing otherwise. The trace is only active in this
+	context: work done on other threads is recorded only if it runs in a
+	copy of it (see contextvars.copy_context), and work done on other
+	processes is not recorded.
+	"""
+	trace = Trace()
+	token = current.set(trace)
+	try:
+		yield trace
+	finally:
+		current.reset(token)
+		if path is not None:
+			trace.save(path)
+
+def stage(name, **args):
+	"""
+	Times the with block as the stage name of the active trace, if any.
+	"""
+	trace = current.get()
+	if trace is None:
+		return nullcontext()
+	return trace.stage(name, **args)
+
+def timed(name):
+	"""
+	Decorates a function so that every call is timed as the stage name of
+	the active trace, if any.
+	"""
+	def decorate(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			trace = current.get()
+			if trace is None:
+				return function(*args, **kwargs)
+			with trace.stage(name, function=function.__name__):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorate
+
+def count(name, amount=1):
+	"""
+	Adds amount to the counter name of the active trace, if any.
+	"""
+	trace = current.get()
+	if trace is not None:
+		trace.count(name, amount)
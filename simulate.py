@@ -0,0 +1,177 @@
+#!/usr/bin/python
+import argparse
+import json
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from cutlist import Cutlist
+from visualise import replay, axis_rotation, mark_starts
+
+#Edge of a voxel in mm
+resolution = 0.05
+
+#Marks rasterised at a time, which bounds the memory used
+mark_chunk = 4096
+
+def block_grid(block, resolution=resolution):
+	"""
+	This function returns the corner of the voxel grid of a block nearest
+	(-inf,-inf,-inf) and the grid's shape. The block is width along x and
+	length along y, centred on (origin_x, origin_y), from z = 0 up to its
+	thickness, as the cuts are laid out.
+	"""
+	low = np.array([block["origin_x"] - block["width"]/2, block["origin_y"] - block["length"]/2, 0.0])
+	high = np.array([block["origin_x"] + block["width"]/2, block["origin_y"] + block["length"]/2, block["thickness"]])
+	return low, tuple(int(n) for n in np.maximum(np.ceil((high - low)/resolution), 1))
+
+def kerf_stencil(rotation, laser, resolution=resolution, kerf_width=None):
+	"""
+	This function returns the offsets, in voxels of the block, of every
+	voxel a mark removes around each point along it. The laser converges
+	on its focus at kerf_angle/2, and a mark removes what is inside that
+	cone from the focus up to the layer above, z_spacing higher, where it
+	is kerf_width (xy_spacing by default) wide at the focus. rotation turns
+	the machine's axes into the block's, as the a and c axes have turned
+	the block. The kerf is at least a voxel wide and high, so that a mark
+	narrower than a voxel is not missed between voxel centres.
+	"""
+	height = max(laser["z_spacing"], resolution)
+	radius = max((laser["xy_spacing"] if kerf_width is None else kerf_width)/2, resolution/2)
+	taper = math.tan(math.radians(laser["kerf_angle"]/2))
+	reach = int(math.ceil(math.hypot(radius + taper*height, height)/resolution)) + 1
+	steps = np.arange(-reach, reach + 1)
+	offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+	#Offsets in the block's axes, in the machine's
+	machine = (offsets * resolution) @ rotation
+	up = machine[:,2]
+	inside = ((up >= -resolution/2) & (up <= height)
+			  & (np.hypot(machine[:,0], machine[:,1]) <= radius + taper*np.maximum(up, 0)))
+	return offsets[inside]
+
+def ablate(solid, low, resolution, rotation, stencil, start, end):
+	"""
+	This function removes from solid, the voxel grid of the block with its
+	corner at low, what a chunk of marks from start to end, in the machine's
+	axes, cut. Points are taken along each mark a voxel apart, and the
+	stencil of the kerf is stamped at the voxel of each, so the removal is
+	accurate to within a voxel.
+	"""
+	#Scans are usually closer together than voxels, so marks whose ends are within half a voxel
+	#of each other are only rasterised once
+	ends = np.round(np.concatenate((start @ rotation.T, end @ rotation.T), axis=1) * (2/resolution)).astype(np.int64)
+	ends = np.unique(ends, axis=0) * (resolution/2)
+	start, end = ends[:,:3], ends[:,3:]
+	samples = np.ceil(np.linalg.norm(end - start, axis=1)/resolution).astype(int) + 1
+	mark = np.repeat(np.arange(len(start)), samples)
+	t = (np.arange(len(mark)) - np.repeat(np.cumsum(samples) - samples, samples)) / np.maximum(samples[mark] - 1, 1)
+	points = start[mark] + (end - start)[mark] * t[:,None]
+	voxels = np.floor((points - low)/resolution).astype(np.int64)
+	#Many points still fall in the same voxel. They are numbered in the grid padded by the stencil's reach, which is quicker to sort.
+	reach = np.abs(stencil).max(axis=0, initial=0)
+	padded = np.array(solid.shape) + 2*reach
+	voxels = voxels + reach
+	voxels = voxels[np.all((voxels >= 0) & (voxels < padded), axis=1)]
+	voxels = np.stack(np.unravel_index(np.unique(np.ravel_multi_index(voxels.T, padded)), padded), axis=1) - reach
+	flat = solid.reshape(-1)
+	for first in range(0, len(voxels), max(1, (1 << 20) // max(len(stencil), 1))):
+		removed = (voxels[first:first + (1 << 20) // max(len(stencil), 1), None, :] + stencil[None, :, :]).reshape(-1, 3)
+		removed = removed[np.all((removed >= 0) & (removed < solid.shape), axis=1)]
+		flat[np.ravel_multi_index(removed.T, solid.shape)] = False
+
+def simulate(cut_list, block, laser, resolution=resolution, kerf_width=None, workers=None):
+	"""
+	This function replays a cutlist as visualise() does, and sweeps the
+	kerf of every mark (see kerf_stencil) through a voxel grid of the block
+	(see block_grid) to find the material it removes. The cutlist may be a
+	Cutlist, or a path to or open cutlist file.
+
+	Marks are rasterised mark_chunk at a time, on workers threads if given.
+	Returns the remaining solid as a boolean grid indexed [x, y, z], the
+	grid's corner and resolution, and the volumes removed and remaining in
+	cubic mm.
+	"""
+	points = replay(cut_list)
+	marks, x0, y0, _ = mark_starts(points)
+	#A mark is cut at the z set when it is made, from wherever the galvo was before
+	start = np.stack((x0, y0, points["z"][marks]), axis=1)
+	end = np.stack((points["x"][marks], points["y"][marks], points["z"][marks]), axis=1)
+	low, shape = block_grid(block, resolution)
+	solid = np.ones(shape, dtype=bool)
+
+	tasks = []
+	groups, inverse = np.unique(np.stack((points["a"][marks], points["c"][marks]), axis=1), axis=0, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	for group, (a_set, c_set) in enumerate(groups.tolist()):
+		rotation = axis_rotation(c_set, 2) @ axis_rotation(a_set, 0)
+		stencil = kerf_stencil(rotation, laser, resolution, kerf_width)
+		index = np.flatnonzero(inverse == group)
+		for first in range(0, len(index), mark_chunk):
+			chunk = index[first:first + mark_chunk]
+			tasks.append((solid, low, resolution, rotation, stencil, start[chunk], end[chunk]))
+	if workers:
+		#Voxels are only ever cleared, so chunks can clear them at once
+		with ThreadPoolExecutor(workers) as pool:
+			list(pool.map(lambda task: ablate(*task), tasks))
+	else:
+		for task in tasks:
+			ablate(*task)
+
+	voxel = resolution ** 3
+	return {"solid": solid,
+			"low": low,
+			"resolution": resolution,
+			"removed": float((~solid).sum() * voxel),
+			"remaining": float(solid.sum() * voxel)}
+
+def figure(simulation, size=64):
+	"""
+	This function draws the volume a simulate()d cutlist removed from the
+	block as a plotly isosurface, averaged down to at most size voxels
+	along each axis so that the figure stays small.
+	"""
+	import plotly.graph_objects as go
+	removed = ~simulation["solid"]
+	step = max(1, int(math.ceil(max(removed.shape)/size)))
+	shape = [int(math.ceil(n/step)) for n in removed.shape]
+	padded = np.zeros([n*step for n in shape], dtype=np.float32)
+	padded[:removed.shape[0], :removed.shape[1], :removed.shape[2]] = removed
+	fraction = padded.reshape(shape[0], step, shape[1], step, shape[2], step).mean(axis=(1, 3, 5))
+	centres = [simulation["low"][axis] + (np.arange(shape[axis]) + 0.5) * step * simulation["resolution"] for axis in range(3)]
+	x, y, z = np.meshgrid(*centres, indexing="ij")
+	fig = go.Figure(go.Isosurface(x=x.ravel(), y=y.ravel(), z=z.ravel(), value=fraction.ravel(),
+								  isomin=0.5, isomax=1, surface_count=1, caps=dict(x_show=False, y_show=False, z_show=False)))
+	fig.update_layout(title=f"Removed {simulation['removed']:.2f} mm³, remaining {simulation['remaining']:.2f} mm³",
+					  scene=dict(xaxis_title="x", yaxis_title="y", zaxis_title="z", aspectmode="data"))
+	return fig
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Simulate the material a cutlist removes from its block.")
+	parser.add_argument("config", help="cut configuration JSON, for the block and laser")
+	parser.add_argument("cutlist", nargs="?", help="JSON, CSV or binary cutlist file (default: generate it from config)")
+	parser.add_argument("-r", "--resolution", type=float, default=resolution, help="voxel edge in mm")
+	parser.add_argument("--kerf-width", type=float, default=None, help="kerf width at the focus in mm (default: xy_spacing)")
+	parser.add_argument("-w", "--workers", type=int, default=None, help="threads to rasterise marks on")
+	parser.add_argument("-o", "--output", help="save the remaining solid to this .npz file")
+	parser.add_argument("--show", action="store_true", help="draw the volume removed")
+	args = parser.parse_args(argv)
+
+	with open(args.config) as f:
+		config = json.load(f)
+	block, laser = config["block"], config["laser_cut_config"]
+	if args.cutlist:
+		cut_list = args.cutlist
+	else:
+		import linear
+		cut_list = Cutlist.concat(linear.cut_segments(block, config["desired_cut"], laser))
+	simulation = simulate(cut_list, block, laser, args.resolution, args.kerf_width, args.workers)
+	print(f"{simulation['solid'].shape} voxels of {args.resolution} mm: removed {simulation['removed']:.3f} mm³, "
+		  f"remaining {simulation['remaining']:.3f} mm³")
+	if args.output:
+		np.savez_compressed(args.output, solid=simulation["solid"], low=simulation["low"], resolution=simulation["resolution"])
+	if args.show:
+		figure(simulation).show()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
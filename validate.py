@@ -0,0 +1,157 @@
+#!/usr/bin/python
+import argparse
+import json
+import sys
+import numpy as np
+from cutlist import Cutlist, as_cutlist, axis_positions, load, AXES, A_STEP, MARK, STOP_TRIGGER, Z_ABS
+from profiling import stage
+
+#Machine envelope as (lowest, highest), None where there is no limit: the galvo
+#field in mm for x and y, the stage's z travel in mm and its a and c rotation in
+#degrees. These depend on the machine, so there are no defaults for them: they are
+#given per job through laser["envelope"]. Only what holds on any machine is checked
+#by default: z goes below 0 by design, when cutting past the bottom of the block or
+#calibrating focus, but a z_abs command must not.
+envelope = {"x": (None, None),
+			"y": (None, None),
+			"z": (None, None),
+			"z_abs": (0, None),
+			"a": (None, None),
+			"c": (None, None)}
+
+#Allowed for floating point error in accumulated moves, in mm or degrees
+tolerance = 1e-9
+
+class Validator:
+	"""
+	Checks a cutlist against the machine envelope one segment at a time,
+	carrying the z, a and c positions from one segment to the next, so a
+	cutlist can be checked as it is generated. Every command is checked
+	for being a known command with finite values, every jump and mark for
+	staying inside the galvo field, and every a, c and z move for staying
+	inside the stage's travel. Until an axis is first set by its absolute
+	command its position is unknown, so its relative moves are not checked.
+	"""
+
+	def __init__(self, limits=None):
+		self.limits = dict(envelope, **(limits or {}))
+		self.index = 0
+		#Where each axis is after the last segment, None until it is known
+		self.positions = {axis: None for axis in AXES}
+
+	def check(self, segment):
+		"""
+		Checks the next segment and returns its first violation, as a
+		dictionary of its index in the whole cutlist, the command and what
+		was wrong with it, or None if it is within the envelope.
+		"""
+		op = segment.op
+		found = []
+
+		unknown = np.flatnonzero(op > STOP_TRIGGER)
+		if len(unknown):
+			found.append((unknown[0], f"unknown command {op[unknown[0]]}"))
+
+		#Comparisons with NaN are False, so coordinates that are not numbers fail too
+		(x_low, x_high), (y_low, y_high) = self.limits["x"], self.limits["y"]
+		inside = self.inside(segment.x, x_low, x_high) & self.inside(segment.y, y_low, y_high)
+		points = np.flatnonzero(~inside & (op <= MARK))
+		if len(points):
+			i = points[0]
+			x, y = segment.x[i], segment.y[i]
+			if not (np.isfinite(x) and np.isfinite(y)):
+				found.append((i, "coordinate is not a number"))
+			else:
+				axis, value, low, high = ("x", x, x_low, x_high) if not self.inside(x, x_low, x_high) else ("y", y, y_low, y_high)
+				found.append((i, f"{axis} {value:g} outside [{low}, {high}]"))
+
+		#The stage is only checked at its moves, which are few, so they are picked out first
+		moves = np.flatnonzero((op >= Z_ABS) & (op <= A_STEP))
+		stage_moves = Cutlist(op[moves], segment.x[moves], segment.y[moves], segment.value[moves], segment.fmt[moves])
+		bad = ~np.isfinite(stage_moves.value)
+		if bad.any():
+			found.append((moves[np.argmax(bad)], "value is not a number"))
+		low, high = self.limits["z_abs"]
+		bad = (stage_moves.op == Z_ABS) & ~self.inside(stage_moves.value, low, high)
+		if bad.any():
+			i = np.argmax(bad)
+			found.append((moves[i], f"z_abs {stage_moves.value[i]:g} outside [{low}, {high}]"))
+		for axis, (absolute, relative) in AXES.items():
+			position = axis_positions(stage_moves, axis)
+			known = np.maximum.accumulate(stage_moves.op == absolute) if len(moves) else np.zeros(0, dtype=bool)
+			if self.positions[axis] is not None:
+				#Until the segment sets the axis, it carries on from where the last one left it
+				position = np.where(known, position, position + self.positions[axis])
+				known = np.ones(len(moves), dtype=bool)
+			low, high = self.limits[axis]
+			bad = np.isin(stage_moves.op, (absolute,) + relative) & known & ~self.inside(position, low, high)
+			if bad.any():
+				i = np.argmax(bad)
+				found.append((moves[i], f"{axis} {position[i]:g} outside [{low}, {high}]"))
+			if len(moves) and known[-1]:
+				self.positions[axis] = float(position[-1])
+
+		offset = self.index
+		self.index = self.index + len(op)
+		if not found:
+			return None
+		i, check = min(found, key=lambda violation: violation[0])
+		command = [str(op[i])] if op[i] > STOP_TRIGGER else segment.row(i)
+		return {"index": offset + int(i), "command": command, "check": check}
+
+	def inside(self, values, low, high):
+		"""
+		Returns whether values are within [low, high], allowing for tolerance.
+		"""
+		low = -np.inf if low is None else low - tolerance
+		high = np.inf if high is None else high + tolerance
+		return (values >= low) & (values <= high)
+
+def validate(cutlist, limits=None):
+	"""
+	This function checks a whole cutlist, which may be a Cutlist, JSON, a
+	list of commands or a path to a JSON, CSV or binary cutlist, against the
+	machine envelope. Returns the first violation (see Validator.check), or
+	None if there is none.
+	"""
+	if isinstance(cutlist, str) and not cutlist.lstrip().startswith("["):
+		cutlist = load(cutlist)
+	return Validator(limits).check(as_cutlist(cutlist))
+
+def validated(segments, limits=None):
+	"""
+	Yields segments once each has been checked against the machine envelope,
+	raising an Exception at the first violation.
+	"""
+	validator = Validator(limits)
+	for segment in segments:
+		with stage("validate"):
+			violation = validator.check(segment)
+		if violation is not None:
+			raise Exception(f"Cutlist leaves the machine envelope at command {violation['index']} "
+							f"{violation['command']}: {violation['check']}")
+		yield segment
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Check cutlist files against the machine envelope.")
+	parser.add_argument("cutlists", nargs="+", help="JSON, CSV or binary cutlist files")
+	parser.add_argument("-e", "--envelope", help="JSON of the machine's limits, or a cut configuration with laser_cut_config.envelope")
+	args = parser.parse_args(argv)
+
+	limits = None
+	if args.envelope:
+		with open(args.envelope) as f:
+			limits = json.load(f)
+		limits = limits.get("laser_cut_config", {}).get("envelope", {}) if "laser_cut_config" in limits else limits
+	failed = 0
+	for path in args.cutlists:
+		violation = validate(path, limits)
+		if violation is None:
+			print(f"{path}: OK")
+		else:
+			failed = failed + 1
+			print(f"{path}: command {violation['index']} {violation['command']}: {violation['check']}")
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
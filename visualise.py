@@ -1,83 +1,397 @@
-#!/usr/bin/python
-import json
-import math
-import sys
-import numpy as np
-import plotly.express as px
-import plotly.graph_objs as go
-import pandas as pd
-from scipy.spatial.transform import Rotation as R
-
-#USED FOR TESTING. Read data from file given as argument
-input_file = sys.argv[1]
-f = open(input_file, encoding="utf8")
-
-def rotate_a(X,vector):
-	"""
-	This function rotates vectors X degrees around the x axis, 
-	in the negative direction as defined by the Right Hand Rule.
-	Used to visualise where a cut would be made on a block prior
-	to being rotated.
-	"""
-	axis_vector = (math.radians(-X)) * np.array([1,0,0])
-	r =  R.from_rotvec(axis_vector)
-	return list(r.apply(vector))
-
-def rotate_c(X,a_set,vector):
-	"""
-	This function rotates vectors X degrees around the z axis, 
-	in the negative direction as defined by the Right Hand Rule.
-	Used to visualise where a cut would be made on a block prior
-	to being rotated.
-	"""
-	axis_vector = math.radians(-X) * np.array([0,0,1])
-	r =  R.from_rotvec(axis_vector)
-	return list(r.apply(vector))
-
-def visualise(cut_list):
-	"""
-	This function takes a cutlist, and produces an interactive
-	plotly figure which displays exactly where the cuts in the 
-	cutlist would appear on the block. 
-	""" 
-	cutlist = json.load(cut_list)
-	modified_list =[]
-	z_set = 0
-	c_set = 0
-	a_set = 0
-	cut_num = 0
-	for a in cutlist:
-		if a[0] == "jump" or a[0] == "mark":
-			a.pop(0)
-			a = list(map(float,a)) + [z_set]
-			
-			if a_set != 0 or c_set != 0:
-				a = rotate_a(a_set,a)
-				a = rotate_c(c_set,a_set,a)
-
-			a = a +[f"a_set {a_set} c_set {c_set} z_set {z_set:.1f} cut_num {cut_num}"]
-			modified_list.append(a)
-
-		elif a[0] == "z_abs":
-			z_set = float(a[1])
-			cut_num += 1
-		elif a[0] == "c_abs":
-			c_set = float(a[1])
-		elif a[0] == "a_abs":
-			a_set = float(a[1])
-
-		elif a[0] == "z_rel" or a[0] == "z_step":
-			z_set = z_set + float(a[1])
-		elif a[0] == "c_rel" or a[0] == "c_step":
-			c_set = c_set + float(a[1])
-		elif a[0] == "a_rel" or a[0] == "a_step":
-			a_set = a_set + float(a[1])
-		else:
-			pass
-	df = pd.DataFrame(modified_list, columns = ["x","y","z","layer"])
-	fig = px.line_3d(df,"x","y","z",color="layer")
-	#fig.update_layout(scene_aspectmode = "data")
-	fig.show()
-
-visualise(f)
-
+#!/usr/bin/python
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from cutlist import Cutlist, axis_positions, file_names, read_chunks, AXES, JUMP, MARK, Z_ABS
+
+#plotly and pandas take seconds to import, so they are only imported by the
+#functions that use them
+
+#Most points drawn by visualise() before scans are left out, which keeps deep
+#jobs from freezing the browser. None draws every point.
+vertex_budget = 200000
+
+#Width and height in pixels of each projection exported as PNG
+projection_size = 800
+
+def axis_rotation(X, axis):
+	"""
+	This function returns the matrix that rotates vectors X degrees around
+	axis (0 for x, 2 for z), in the negative direction as defined by the
+	Right Hand Rule.
+	"""
+	cos, sin = math.cos(math.radians(-X)), math.sin(math.radians(-X))
+	i, j = [k for k in range(3) if k != axis]
+	matrix = np.eye(3)
+	matrix[i,i], matrix[i,j], matrix[j,i], matrix[j,j] = cos, -sin, sin, cos
+	return matrix
+
+def rotate_a(X,vector):
+	"""
+	This function rotates vectors X degrees around the x axis, 
+	in the negative direction as defined by the Right Hand Rule.
+	Used to visualise where a cut would be made on a block prior
+	to being rotated.
+	"""
+	return list(axis_rotation(X, 0) @ np.asarray(vector, dtype=float))
+
+def rotate_c(X,a_set,vector):
+	"""
+	This function rotates vectors X degrees around the z axis, 
+	in the negative direction as defined by the Right Hand Rule.
+	Used to visualise where a cut would be made on a block prior
+	to being rotated.
+	"""
+	return list(axis_rotation(X, 2) @ np.asarray(vector, dtype=float))
+
+def replay(cut_list):
+	"""
+	This function reduces a cutlist to the points it jumps and marks to, as
+	arrays of their x, y, the z, a and c set when they are cut, and their
+	cut_num, the number of z_abs commands before them. The cutlist may be a
+	Cutlist, or a path to or open JSON, CSV or binary cutlist file, which is
+	read and replayed a chunk at a time (see read_chunks) so that only its
+	points are kept in memory.
+	"""
+	chunks = [cut_list] if isinstance(cut_list, Cutlist) else read_chunks(cut_list)
+	parts = {key: [] for key in ("x", "y", "jump", "z", "z_moved", "a", "a_moved", "c", "c_moved", "cut_num")}
+	#Where each axis is and whether it has moved after the last chunk, and the z_abs commands so far
+	position = {axis: 0.0 for axis in AXES}
+	moved = {axis: False for axis in AXES}
+	cut_num = 0
+	for chunk in chunks:
+		op = chunk.op
+		if not len(op):
+			continue
+		is_point = (op == JUMP) | (op == MARK)
+		parts["x"].append(chunk.x[is_point])
+		parts["y"].append(chunk.y[is_point])
+		parts["jump"].append(op[is_point] == JUMP)
+		for axis, (absolute, relative) in AXES.items():
+			#Until the chunk sets the axis, it carries on from where the last one left it
+			known = np.maximum.accumulate(op == absolute)
+			positions = axis_positions(chunk, axis)
+			positions = np.where(known, positions, positions + position[axis])
+			#Until an axis is first moved it is shown as the integer 0, as in the original labels
+			has_moved = moved[axis] | (np.cumsum(np.isin(op, (absolute,) + relative)) > 0)
+			parts[axis].append(positions[is_point])
+			parts[axis + "_moved"].append(has_moved[is_point])
+			position[axis], moved[axis] = float(positions[-1]), bool(has_moved[-1])
+		cut_nums = cut_num + np.cumsum(op == Z_ABS)
+		parts["cut_num"].append(cut_nums[is_point])
+		cut_num = int(cut_nums[-1])
+	empty = {"jump": bool, "z_moved": bool, "a_moved": bool, "c_moved": bool, "cut_num": int}
+	return {key: np.concatenate(values) if values else np.zeros(0, dtype=empty.get(key, float))
+			for key, values in parts.items()}
+
+def mark_starts(points):
+	"""
+	This function returns the index of every mark among replay()ed points,
+	and the x, y and z each is cut from: the point before it, or the
+	origin, (0,0) at the mark's z, for a mark before any point.
+	"""
+	marks = np.flatnonzero(~points["jump"])
+	first = marks == 0
+	before = np.maximum(marks - 1, 0)
+	return (marks, np.where(first, 0.0, points["x"][before]), np.where(first, 0.0, points["y"][before]),
+			points["z"][np.where(first, marks, before)])
+
+def transform(points):
+	"""
+	This function places every point where it would be cut on the block
+	before it is rotated, as an (n, 3) array. Points are grouped by the a
+	and c set when they were cut, and each group is rotated a degrees around
+	x and then c degrees around z with a single matrix multiply.
+	"""
+	xyz = np.stack((points["x"], points["y"], points["z"]), axis=1)
+	groups, inverse = np.unique(np.stack((points["a"], points["c"]), axis=1), axis=0, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	order = np.argsort(inverse, kind="stable")
+	bounds = np.searchsorted(inverse[order], np.arange(len(groups) + 1))
+	for g, (a_set, c_set) in enumerate(groups.tolist()):
+		if a_set != 0 or c_set != 0:
+			index = order[bounds[g]:bounds[g + 1]]
+			xyz[index] = xyz[index] @ (axis_rotation(c_set, 2) @ axis_rotation(a_set, 0)).T
+	return xyz
+
+def layer_labels(points):
+	"""
+	This function labels every point with the a, c, z (to 0.1) and cut_num
+	it was cut at. Each different combination is labelled once, and the
+	labels are returned in the order they first appear, with the label
+	number of every point.
+	"""
+	state = np.stack([points["a"], points["c"], points["z"], points["cut_num"],
+					  points["a_moved"], points["c_moved"], points["z_moved"]], axis=1)
+	#The state only changes between layers, so only the first point of each run of the same state is labelled
+	change = np.flatnonzero(np.r_[True, (state[1:] != state[:-1]).any(axis=1)]) if len(state) else np.zeros(0, dtype=int)
+	combinations, first, inverse = np.unique(state[change], axis=0, return_index=True, return_inverse=True)
+	names = []
+	for a_set, c_set, z_set, cut_num, a_moved, c_moved, z_moved in combinations.tolist():
+		a_set, c_set, z_set = [v if moved else 0 for v, moved in ((a_set, a_moved), (c_set, c_moved), (z_set, z_moved))]
+		names.append(f"a_set {a_set} c_set {c_set} z_set {z_set:.1f} cut_num {int(cut_num)}")
+	labels = list(dict.fromkeys(names[i] for i in np.argsort(first, kind="stable")))
+	number = {label: n for n, label in enumerate(labels)}
+	runs = np.array([number[name] for name in names], dtype=int)[inverse.reshape(-1)]
+	return labels, np.repeat(runs, np.diff(np.r_[change, len(state)]))
+
+def decimate(points, codes, budget=vertex_budget):
+	"""
+	This function picks which points to draw so that no more than budget
+	are, and returns their indices. Each layer (a run of points with the
+	same label number in codes) keeps its first and last scans, which
+	outline it, and every Nth scan in between, with N doubled until they
+	fit the budget. If the outlines alone are over budget only every Mth
+	layer is kept, M doubled likewise. A scan is a jump and the marks after it.
+	"""
+	count = len(codes)
+	if budget is None or count <= budget:
+		return np.arange(count)
+	layer_start = np.r_[True, codes[1:] != codes[:-1]]
+	scan = np.cumsum(points["jump"] | layer_start) - 1
+	layer = np.cumsum(layer_start) - 1
+	scan_starts = np.flatnonzero(np.r_[True, scan[1:] != scan[:-1]])
+	scan_sizes = np.diff(np.r_[scan_starts, count])
+	scan_layer = layer[scan_starts]
+	first = np.searchsorted(scan_layer, scan_layer, side="left")
+	last = np.searchsorted(scan_layer, scan_layer, side="right") - 1
+	position = np.arange(len(scan_starts)) - first
+	outline = (position == 0) | (position == last - first)
+
+	stride = 1
+	keep = np.ones(len(scan_starts), dtype=bool)
+	while scan_sizes[keep].sum() > budget and stride <= position.max():
+		stride = stride * 2
+		keep = outline | (position % stride == 0)
+	layer_stride = 1
+	while scan_sizes[keep].sum() > budget and layer_stride <= scan_layer[-1]:
+		layer_stride = layer_stride * 2
+		keep = outline & (scan_layer % layer_stride == 0)
+	return np.flatnonzero(keep[scan])
+
+def layers(cut_list):
+	"""
+	This function returns the labels of the layers of a cutlist, in the
+	order they are cut, for drawing some of them at full resolution.
+	"""
+	return layer_labels(replay(cut_list))[0]
+
+def single_line(points, xyz, codes):
+	"""
+	This function joins the points of every layer into one line, with NaN
+	between layers so they are not joined to each other, for drawing as a
+	single trace. Returns the line's (n, 3) positions, the layer number of
+	each of its vertices for colouring it, and the a, c, z, cut_num and
+	layer number of each vertex as its customdata.
+	"""
+	breaks = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+	line = np.insert(xyz, breaks, np.nan, axis=0)
+	colour = np.insert(codes, breaks, codes[breaks]).astype(float)
+	state = np.stack((points["a"], points["c"], points["z"], points["cut_num"], codes), axis=1).astype(float)
+	return line, colour, np.insert(state, breaks, np.nan, axis=0)
+
+def prepare(cut_list, budget=vertex_budget, only=None):
+	"""
+	This function replays a cutlist and picks the points to draw, as for
+	figure(). Returns their points, where they appear on the block, the
+	layer labels and the label number of each point.
+	"""
+	points = replay(cut_list)
+	labels, codes = layer_labels(points)
+	if only is not None:
+		keep = np.flatnonzero(np.isin(codes, [labels.index(label) for label in only]))
+	else:
+		keep = decimate(points, codes, budget)
+	points = {key: value[keep] for key, value in points.items()}
+	return points, transform(points), labels, codes[keep]
+
+def figure(cut_list, budget=vertex_budget, only=None, single_trace=False):
+	"""
+	This function takes a cutlist, and returns an interactive plotly
+	figure which displays exactly where the cuts in the cutlist would
+	appear on the block. The cutlist may be a JSON, CSV or binary cutlist
+	file, or a Cutlist.
+
+	Scans are left out of large cutlists to draw no more than budget
+	points, see decimate(). Given only, a list of layer labels from
+	layers(), just those layers are drawn, at full resolution.
+
+	Every layer is drawn as its own trace, which plotly is slow to build
+	and draw once there are thousands. With single_trace the whole
+	cutlist is one WebGL trace coloured by layer number instead, with each
+	point's layer shown when hovering over it.
+	"""
+	points, xyz, labels, codes = prepare(cut_list, budget, only)
+	if single_trace:
+		import plotly.graph_objects as go
+		line, colour, customdata = single_line(points, xyz, codes)
+		fig = go.Figure(go.Scatter3d(x=line[:,0], y=line[:,1], z=line[:,2], mode="lines",
+									 line=dict(color=colour, colorscale="Viridis", showscale=True, colorbar=dict(title="layer")),
+									 customdata=customdata,
+									 hovertemplate="a_set %{customdata[0]} c_set %{customdata[1]} z_set %{customdata[2]:.1f} "
+												   "cut_num %{customdata[3]}<extra>layer %{customdata[4]}</extra>"))
+		fig.update_layout(scene=dict(xaxis_title="x", yaxis_title="y", zaxis_title="z"))
+	else:
+		import plotly.express as px
+		import pandas as pd
+		df = pd.DataFrame({"x": xyz[:,0], "y": xyz[:,1], "z": xyz[:,2],
+						   "layer": pd.Categorical.from_codes(codes, labels).remove_unused_categories()})
+		fig = px.line_3d(df,"x","y","z",color="layer")
+	#fig.update_layout(scene_aspectmode = "data")
+	return fig
+
+def visualise(cut_list, budget=vertex_budget, only=None, single_trace=False):
+	"""
+	This function shows the figure() of a cutlist.
+	""" 
+	figure(cut_list, budget, only, single_trace).show()
+
+def projections(points, xyz, size=projection_size):
+	"""
+	This function draws the marks of a cutlist seen from the top (x, y) and
+	from the side (x, z), side by side, as a greyscale image of two size by
+	size panels with black lines on white. Jumps are not drawn.
+	"""
+	image = np.full((size, 2 * size), 255, dtype=np.uint8)
+	marks = np.flatnonzero(~points["jump"][1:]) + 1
+	starts, ends = xyz[marks - 1], xyz[marks]
+	margin = 0.05 * size
+	for panel, axis in enumerate((1, 2)):
+		view = np.concatenate((starts[:, [0, axis]], ends[:, [0, axis]]))
+		if not len(view):
+			continue
+		low = view.min(axis=0)
+		scale = (size - 1 - 2 * margin) / max(float((view.max(axis=0) - low).max()), 1e-9)
+		#Segments are drawn by sampling each at every pixel along it, a chunk of segments at a time
+		for first in range(0, len(marks), 1 << 16):
+			a = (starts[first:first + (1 << 16)][:, [0, axis]] - low) * scale + margin
+			b = (ends[first:first + (1 << 16)][:, [0, axis]] - low) * scale + margin
+			samples = np.ceil(np.abs(b - a).max(axis=1)).astype(int) + 1
+			segment = np.repeat(np.arange(len(a)), samples)
+			t = (np.arange(len(segment)) - np.repeat(np.cumsum(samples) - samples, samples)) / np.maximum(samples[segment] - 1, 1)
+			pixels = np.rint(a[segment] + (b - a)[segment] * t[:, None]).astype(int)
+			image[size - 1 - pixels[:, 1], panel * size + pixels[:, 0]] = 0
+	return image
+
+def write_png(path, image):
+	"""
+	Writes a greyscale uint8 image to path as a PNG.
+	"""
+	def chunk(kind, data):
+		return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+	height, width = image.shape
+	rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8), image), axis=1)
+	with open(path, "wb") as f:
+		f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+				+ chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) + chunk(b"IEND", b""))
+
+def export(cut_list, path, budget=vertex_budget, single_trace=True):
+	"""
+	This function writes a preview of a cutlist file to path without
+	showing it, and returns its entry in the export report, with the time
+	taken and the size written. A .png path gets the top and side
+	projections(), which only need numpy. Anything else gets the figure()
+	as HTML, which loads plotly.min.js from its own directory rather than
+	inlining it. A cutlist that fails is recorded with its error.
+	"""
+	entry = {"cutlist": cut_list, "preview": path}
+	start = time.perf_counter()
+	try:
+		if path.endswith(".png"):
+			points, xyz = prepare(cut_list, budget)[:2]
+			write_png(path, projections(points, xyz))
+		else:
+			figure(cut_list, budget, single_trace=single_trace).write_html(path, include_plotlyjs="directory")
+		entry["status"] = "ok"
+		entry["bytes"] = os.path.getsize(path)
+	except Exception as e:
+		entry["status"] = "error"
+		entry["error"] = f"{type(e).__name__}: {e}"
+	entry["seconds"] = time.perf_counter() - start
+	return entry
+
+def export_all(cut_lists, output_dir, kind="html", workers=None, processes=True, budget=vertex_budget, single_trace=True):
+	"""
+	This function exports a preview of every cutlist file in cut_lists to
+	output_dir as "html" or "png" (see export()), and writes previews.json,
+	which lists every preview's status, render time and size in the order
+	given. Previews are named after their cutlists, numbered where two
+	cutlists have the same name (see cutlist.file_names).
+
+	The previews are rendered by a pool of workers, os.cpu_count() by
+	default, which are processes unless processes is False. The HTML
+	previews share one copy of plotly.min.js, written to output_dir first.
+	"""
+	os.makedirs(output_dir, exist_ok=True)
+	workers = workers or os.cpu_count()
+	start = time.perf_counter()
+	if kind == "html":
+		from plotly.offline import get_plotlyjs
+		plotly_js = os.path.join(output_dir, "plotly.min.js")
+		if not os.path.exists(plotly_js):
+			with open(plotly_js, "w", encoding="utf8") as f:
+				f.write(get_plotlyjs())
+	pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+	with pool:
+		cut_lists = list(cut_lists)
+		stems = []
+		for cut_list in cut_lists:
+			name = os.path.basename(cut_list)
+			while os.path.splitext(name)[1] in (".json", ".ndjson", ".csv", ".gz", ".bin"):
+				name = os.path.splitext(name)[0]
+			stems.append(name)
+		futures = [pool.submit(export, cut_list, os.path.join(output_dir, f"{name}.{kind}"), budget, single_trace)
+				   for cut_list, name in zip(cut_lists, file_names(stems))]
+		entries = [future.result() for future in futures]
+
+	report = {"workers": workers,
+			  "seconds": time.perf_counter() - start,
+			  "bytes": sum(entry.get("bytes", 0) for entry in entries),
+			  "failed": sum(entry["status"] != "ok" for entry in entries),
+			  "previews": entries}
+	with open(os.path.join(output_dir, "previews.json"), "w") as f:
+		json.dump(report, f, indent=4)
+	return report
+
+def main(argv=None):
+	#USED FOR TESTING. Read data from file given as argument
+	parser = argparse.ArgumentParser(description="Draw where a cutlist would cut the block.")
+	parser.add_argument("cutlists", nargs="+", help="JSON, CSV or binary cutlist files")
+	parser.add_argument("--budget", type=int, default=vertex_budget, help="most points to draw, 0 for all")
+	parser.add_argument("--layer", action="append", help="draw this layer at full resolution, may be repeated")
+	parser.add_argument("--list-layers", action="store_true", help="print the layer labels and stop")
+	parser.add_argument("--single-trace", action="store_true", help="draw every layer as one trace, for large cutlists")
+	parser.add_argument("-o", "--output", help="export previews to this directory instead of showing them")
+	parser.add_argument("--png", action="store_true", help="export top and side projections as PNG rather than HTML")
+	parser.add_argument("-w", "--workers", type=int, default=None, help="number of export workers (default: one per CPU)")
+	parser.add_argument("--threads", action="store_true", help="export with threads rather than processes")
+	args = parser.parse_args(argv)
+	if args.output:
+		#Exported HTML is always drawn as one trace, which keeps the files small
+		report = export_all(args.cutlists, args.output, "png" if args.png else "html", args.workers, not args.threads,
+							args.budget or None)
+		for entry in report["previews"]:
+			if entry["status"] == "ok":
+				print(f"{entry['preview']}: {entry['seconds']*1000:.0f} ms {entry['bytes']/1e6:.2f} MB")
+			else:
+				print(f"{entry['cutlist']}: {entry['error']}")
+		print(f"{len(report['previews'])} previews in {report['seconds']:.1f}s, {report['failed']} failed")
+		return 1 if report["failed"] else 0
+	for cut_list in args.cutlists:
+		with open(cut_list, "rb") as f:
+			if args.list_layers:
+				print("\n".join(layers(f)))
+			else:
+				visualise(f, args.budget or None, args.layer, args.single_trace)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
+